@@ -0,0 +1,151 @@
+"""Compact binary form of balances.json.
+
+Paths are stored once, sorted, in a single UTF-8 blob with an offset table, and rarity/item type are packed into one byte per
+balance. Lookups binary search the file contents directly, so nothing is parsed up front and the file can be memory-mapped
+read-only. The file is only opened on the first lookup.
+
+Convert with `python balance_ref.py balances.json balances.bin`. BalanceRef.get gives the same [rarity, item type] lists as
+the JSON, so it can be used anywhere the loaded JSON dict was.
+"""
+import hashlib
+import json
+import mmap
+import struct
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'DCBR'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHII32s')  # magic, version, reserved, count, blob length, sha256 of everything after the header
+
+
+def convert_json(json_path: str, out_path: str) -> None:
+    with open(json_path, 'r') as file:
+        balances: Dict[str, List[int]] = json.load(file)
+    write_balance_ref(balances, out_path)
+
+
+def write_balance_ref(balances: Dict[str, List[int]], out_path: str) -> None:
+    entries = sorted((path.encode('utf-8'), values) for path, values in balances.items())
+    offsets = [0]
+    for path, _ in entries:
+        offsets.append(offsets[-1] + len(path))
+    for _, (rarity, item_type) in entries:
+        if not (0 <= rarity < 16 and 0 <= item_type < 16):
+            raise ValueError(f"Rarity {rarity} or item type {item_type} doesn't fit in 4 bits")
+
+    body = struct.pack(f'<{len(offsets)}I', *offsets) \
+        + bytes((rarity << 4) | item_type for _, (rarity, item_type) in entries) \
+        + b''.join(path for path, _ in entries)
+    header = _HEADER.pack(MAGIC, VERSION, 0, len(entries), offsets[-1], hashlib.sha256(body).digest())
+    with open(out_path, 'wb') as file:
+        file.write(header + body)
+
+
+class BalanceRef:
+    """Read-only balance reference backed by the binary file. Supports the dict methods the engine uses."""
+
+    def __init__(self, path: str, use_mmap: bool = False, verify: bool = False):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.verify = verify
+        self._data = None
+        self._file = None
+        self.count = 0
+        self._digest = b''
+        self._offsets_start = 0
+        self._values_start = 0
+        self._blob_start = 0
+
+    def _load(self) -> None:
+        if self.use_mmap:
+            self._file = open(self.path, 'rb')
+            data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+
+        magic, version, _, count, blob_len, digest = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a balance reference file")
+        if version != VERSION:
+            raise ValueError(f"Balance reference version {version} not supported, expected {VERSION}")
+        if self.verify and hashlib.sha256(data[_HEADER.size:]).digest() != digest:
+            raise ValueError(f"{self.path} is corrupt, hash doesn't match")
+
+        self.count = count
+        self._digest = digest
+        self._offsets_start = _HEADER.size
+        self._values_start = self._offsets_start + 4 * (count + 1)
+        self._blob_start = self._values_start + count
+        if len(data) != self._blob_start + blob_len:
+            raise ValueError(f"{self.path} is truncated")
+        self._data = data
+
+    def close(self) -> None:
+        if self.use_mmap and self._data is not None:
+            self._data.close()
+            self._file.close()
+        self._data = None
+
+    def _ensure_loaded(self) -> None:
+        if self._data is None:
+            self._load()
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the contents, stored in the header"""
+        self._ensure_loaded()
+        return self._digest.hex()
+
+    def _path_bytes(self, idx: int) -> bytes:
+        start, end = struct.unpack_from('<II', self._data, self._offsets_start + 4 * idx)
+        return self._data[self._blob_start + start:self._blob_start + end]
+
+    def _values(self, idx: int) -> List[int]:
+        packed = self._data[self._values_start + idx]
+        return [packed >> 4, packed & 0xF]
+
+    def _find(self, path: str) -> int:
+        key = path.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._path_bytes(lo) == key:
+            return lo
+        return -1
+
+    def get(self, path: str, default=None) -> Optional[List[int]]:
+        self._ensure_loaded()
+        idx = self._find(path)
+        return default if idx < 0 else self._values(idx)
+
+    def __getitem__(self, path: str) -> List[int]:
+        values = self.get(path)
+        if values is None:
+            raise KeyError(path)
+        return values
+
+    def __contains__(self, path: str) -> bool:
+        self._ensure_loaded()
+        return self._find(path) >= 0
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return self.count
+
+    def items(self) -> Iterator[Tuple[str, List[int]]]:
+        self._ensure_loaded()
+        for idx in range(self.count):
+            yield self._path_bytes(idx).decode('utf-8'), self._values(idx)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python balance_ref.py balances.json balances.bin")
+        sys.exit(1)
+    convert_json(sys.argv[1], sys.argv[2])
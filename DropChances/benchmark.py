@@ -0,0 +1,233 @@
+"""Benchmarks for the drops engine on synthetic pool graphs, no game needed.
+
+Graphs are built from the same dataclasses the offline snapshots use, with init data already evaluated, so the engine runs
+exactly as it does from a snapshot. Each scale sets the number of top level pools, the depth and fan-out of the tree under
+each, and how often a sub-pool is shared with another parent rather than being new. Graphs come from a seeded RNG, so a scale
+always gives the same graph.
+
+Run `python benchmark.py` to compare against benchmarks/baselines.json, and `python benchmark.py --update` to rewrite the
+baselines after an intended change. Node counts must match exactly. Times and memory are noisy, so they're only shown
+against the baselines, unless --check-measurements also fails the run when they grow past --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Dict, List, Optional
+
+try:
+    from Mods.WD import drops
+    from Mods.WD.snapshot import OfflineItemPool
+except ImportError:
+    import drops
+    from snapshot import OfflineItemPool
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baselines.json')
+UNCOMMON_WEIGHT = 'GD_Balance.Weighting.Weight_2_Uncommon'
+
+
+@dataclass
+class Scale:
+    name: str
+    pools: int  # Top level ItemPoolInfos in the source
+    depth: int  # Levels of sub-pools under each top level pool. Pools at the last level hold balances.
+    fan_out: int  # BalancedItems per pool
+    sharing: float  # Chance a sub-pool reference reuses an existing pool at that level
+    clones: float = 0.0  # Chance a new pool is a copy of an existing one under another name, like DLC and _Uncommon copies
+    sources: int = 1  # More than one splits the top level pools between sources, each taking half, like the enemy pool lists
+    seed: int = 0
+
+
+SCALES = [
+    Scale('small', pools=4, depth=2, fan_out=4, sharing=0.25),
+    Scale('medium', pools=16, depth=3, fan_out=5, sharing=0.5),
+    Scale('haderax', pools=60, depth=3, fan_out=6, sharing=0.7),
+    Scale('wide', pools=200, depth=2, fan_out=8, sharing=0.9),
+    Scale('clones', pools=60, depth=3, fan_out=6, sharing=0.3, clones=0.5),
+    Scale('catalog', pools=60, depth=3, fan_out=6, sharing=0.7, sources=12),
+]
+
+
+def init_data(value: Fraction, uncommon: bool = False) -> drops.EvaluatedInitializationData:
+    return drops.EvaluatedInitializationData(
+        BaseValueConstant=float(value),
+        BaseValueAttribute=None,
+        InitializationDefinition=drops.OfflineObject(UNCOMMON_WEIGHT) if uncommon else None,
+        BaseValueScaleConstant=1.0,
+        value=value)
+
+
+class GraphBuilder:
+    """Builds one scale's graph along with the balance reference its balances need"""
+
+    def __init__(self, scale: Scale):
+        self.scale = scale
+        self.rng = random.Random(scale.seed)
+        self.levels: List[List[OfflineItemPool]] = [[] for _ in range(scale.depth + 1)]
+        self.balance_ref: Dict[str, List[int]] = {}
+
+    def balance(self) -> drops.OfflineObject:
+        path = f"Bench.Balance_{len(self.balance_ref)}"
+        self.balance_ref[path] = [self.rng.randrange(1, 10), self.rng.randrange(0, 12)]
+        return drops.OfflineObject(path)
+
+    def pool(self, level: int) -> OfflineItemPool:
+        existing = self.levels[level]
+        if existing and self.rng.random() < self.scale.sharing:
+            return self.rng.choice(existing)
+        if existing and self.scale.clones and self.rng.random() < self.scale.clones:
+            original = self.rng.choice(existing)
+            clone = OfflineItemPool(path=f"Bench.Pool_{level}_{len(existing)}", BalancedItems=original.BalancedItems,
+                                    Quantity=None, MinGameStageRequirement=None, bEligibleForUncommonWeightMultiplier=True)
+            existing.append(clone)
+            return clone
+
+        items = []
+        for _ in range(self.scale.fan_out):
+            weight = Fraction(self.rng.randrange(1, 100), 10)
+            uncommon = self.rng.random() < 0.2
+            if level < self.scale.depth:
+                items.append(drops.BalancedInventoryData(self.pool(level + 1), None, init_data(weight, uncommon), True))
+            else:
+                items.append(drops.BalancedInventoryData(None, self.balance(), init_data(weight, uncommon), True))
+        pool = OfflineItemPool(path=f"Bench.Pool_{level}_{len(existing)}", BalancedItems=items, Quantity=None,
+                               MinGameStageRequirement=None, bEligibleForUncommonWeightMultiplier=True)
+        existing.append(pool)
+        return pool
+
+    def pool_lists(self) -> List[List[drops.ItemPoolInfo]]:
+        """One pool list per source"""
+        pool_list = [drops.ItemPoolInfo(self.pool(0), init_data(Fraction(self.rng.randrange(1, 11), 10)))
+                     for _ in range(self.scale.pools)]
+        if self.scale.sources == 1:
+            return [pool_list]
+        return [self.rng.sample(pool_list, len(pool_list) // 2) for _ in range(self.scale.sources)]
+
+    def pool_count(self) -> int:
+        return sum(len(level) for level in self.levels)
+
+
+success_def = drops.mask_success_def(drops.rarity_item_type_mask(
+    [r for r in drops.Rarity if r.category == 'Legendary+'], [t for t in drops.ItemType if t.category != 'Other']))
+
+
+def evaluate_fresh(builder: GraphBuilder, pool_lists: List[List[drops.ItemPoolInfo]]) -> None:
+    """Evaluates with an empty eval cache, like a new run in game"""
+    drops.set_run_context(None, 72, 3, Fraction(1), builder.balance_ref, success_def)
+    drops.SourcePlanner([drops.LootSource(f"{builder.scale.name} {i}", pool_list, evaluate=False)
+                         for i, pool_list in enumerate(pool_lists)]).evaluate()
+
+
+def bad_routes(pool_lists: List[List[drops.ItemPoolInfo]]) -> int:
+    """Routes LeafFlow.provenance gives that don't follow references the pools actually have, e.g. naming a clone the
+    source never uses because it was merged with one it does. Run after evaluate_fresh, on its graph."""
+    graph = drops.pool_graph()
+    pools = {drops.path_name(info.ItemPool): info.ItemPool for pool_list in pool_lists for info in pool_list}
+    stack = list(pools.values())
+    while stack:
+        for item in stack.pop().BalancedItems:
+            if item.ItmPoolDefinition and drops.path_name(item.ItmPoolDefinition) not in pools:
+                pools[drops.path_name(item.ItmPoolDefinition)] = item.ItmPoolDefinition
+                stack.append(item.ItmPoolDefinition)
+
+    def references(pool_path: str) -> List[str]:
+        return [drops.path_name(item.ItmPoolDefinition or item.InvBalanceDefinition) for item in pools[pool_path].BalancedItems]
+
+    bad = 0
+    for root_path in sorted(set(drops.path_name(info.ItemPool) for pool_list in pool_lists for info in pool_list)):
+        flow = graph.flow([(graph.pool_ids[root_path], Fraction(1))])
+        for balance_id in flow.mass:
+            route = flow.provenance(graph, balance_id, root_path) + [graph.balance_paths[balance_id]]
+            if route[0] != root_path or any(child not in references(parent) for parent, child in zip(route, route[1:])):
+                bad += 1
+    return bad
+
+
+def run_scale(scale: Scale, mode: drops.NumericMode) -> Dict[str, float]:
+    builder = GraphBuilder(scale)
+    pool_lists = builder.pool_lists()
+    drops.set_numeric_mode(mode)
+
+    start = time.perf_counter()
+    evaluate_fresh(builder, pool_lists)
+    wall = time.perf_counter() - start
+
+    tracemalloc.start()  # Separate run, tracing slows everything down a lot
+    evaluate_fresh(builder, pool_lists)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    routes = bad_routes(pool_lists)
+
+    return {
+        'wall_s': round(wall, 4),
+        'peak_kb': round(peak / 1024, 1),
+        'node_visits': drops.pool_graph().evaluations,
+        'distinct_pools': builder.pool_count(),
+        'eval_misses': drops._EVAL_CACHE.misses,
+        'merged_pools': drops.pool_graph().merged_pools,
+        'bad_routes': routes,
+    }
+
+
+def compare(result: Dict[str, float], baseline: Dict[str, float], tolerance: Optional[float] = None) -> List[str]:
+    """Problems with result against its baseline. Exact counts must match, and with a tolerance, measurements can grow by
+    that much."""
+    problems = []
+    for key in ('node_visits', 'distinct_pools', 'eval_misses', 'merged_pools'):
+        if result[key] != baseline.get(key):
+            problems.append(f"{key} {result[key]} != baseline {baseline.get(key)}")
+    if result['bad_routes']:
+        problems.append(f"{result['bad_routes']} provenance routes don't follow the pools' references")
+    for key in ('wall_s', 'peak_kb'):
+        if tolerance is not None and baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            problems.append(f"{key} {result[key]} > baseline {baseline[key]} by more than {tolerance:.0%}")
+    return problems
+
+
+def run(scale_names: List[str], modes: List[drops.NumericMode], update: bool, tolerance: Optional[float]) -> bool:
+    baselines: Dict[str, Dict[str, Dict[str, float]]] = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, 'r') as file:
+            baselines = json.load(file)
+
+    ok = True
+    changed = False
+    print(f"{'scale':<10}{'mode':<10}{'wall s':>10}{'peak KB':>12}{'visits':>10}{'pools':>8}{'merged':>8}   vs baseline")
+    for scale in [s for s in SCALES if s.name in scale_names]:
+        for mode in modes:
+            result = run_scale(scale, mode)
+            baseline = baselines.get(scale.name, {}).get(mode.value)
+            if update or baseline is None:
+                baselines.setdefault(scale.name, {})[mode.value] = result
+                changed = True
+                status = 'stored'
+            else:
+                problems = compare(result, baseline, tolerance)
+                ok = ok and not problems
+                status = '; '.join(problems) if problems else f"ok ({result['wall_s'] / max(baseline['wall_s'], 1e-9):.2f}x time)"
+            print(f"{scale.name:<10}{mode.value:<10}{result['wall_s']:>10.4f}{result['peak_kb']:>12.1f}"
+                  f"{result['node_visits']:>10}{result['distinct_pools']:>8}{result['merged_pools']:>8}   {status}")
+
+    if not changed:
+        return ok
+    os.makedirs(os.path.dirname(BASELINES_PATH), exist_ok=True)
+    with open(BASELINES_PATH, 'w') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', default=[s.name for s in SCALES], choices=[s.name for s in SCALES])
+    parser.add_argument('--modes', nargs='+', default=['exact', 'float'], choices=[m.value for m in drops.NumericMode])
+    parser.add_argument('--update', action='store_true', help='Overwrite the stored baselines with this run')
+    parser.add_argument('--check-measurements', action='store_true', help='Also fail when time or memory grow past --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed growth in time and memory, 0.5 = 50%%')
+    args = parser.parse_args()
+    tolerance = args.tolerance if args.check_measurements else None
+    raise SystemExit(0 if run(args.scales, [drops.NumericMode(m) for m in args.modes], args.update, tolerance) else 1)
@@ -0,0 +1,137 @@
+"""Odds of collecting every balance in a set, e.g. all four Seraph items a boss drops.
+
+For any subset S of the targets, the chance none of S drops from one kill is exact and cheap: the source's pools roll
+independently and each roll gives one item, so it's the product over pool rolls of 1 - (chance the pool gives something in S).
+Inclusion-exclusion over those gives the chance of having every target after n kills,
+
+    P(all by n) = sum over S of (-1)^|S| * none(S)^n
+
+and the expected kills, sum over non-empty S of (-1)^(|S|+1) / (1 - none(S)). none(S) is built for all subsets at once
+with a subset-sum per pool, so 16 targets is 65536 values per pool that can drop any of them. Chest configurations are
+mixed by their weights.
+"""
+from functools import lru_cache
+from typing import List, Optional, Union
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+MAX_TARGETS = 20
+
+
+@lru_cache(maxsize=None)
+def target_def(path: str) -> drops.SuccessDef:
+    """Same function for the same path, so the graph's success table for a set of targets gets reused"""
+    def is_target(inv_bal: drops.InventoryBalanceDefinitionWrapper) -> bool:
+        return drops.path_name(inv_bal.inventory_balance_definition) == path
+    return is_target
+
+
+def pool_target_probs(pool_list: List[drops.ItemPoolInfo], targets: List[str]) -> List[List[float]]:
+    """For each roll of a pool that can drop a target, the chance it gives each target, from the run's PoolGraph with one
+    success definition per target. Rolls are independent, so a pool with a Quantity is repeated."""
+    graph = drops.pool_graph()
+    table = graph.success_table(tuple(target_def(path) for path in targets))
+    pools = []
+    for pool in pool_list:
+        probability = drops.eval_prob_item_pool_info(pool)
+        if not pool.ItemPool or probability == 0:
+            continue
+        probs = [probability * p for p in table.pool(graph.add_pool(pool.ItemPool))]
+        if any(probs):
+            pools += [[float(p) for p in probs]] * drops.pool_quantity(pool.ItemPool)
+    return pools
+
+
+def none_dropped(pools: List[List[float]], target_count: int) -> List[float]:
+    """Chance none of the subset drops from one kill, indexed by subset bitmask"""
+    size = 1 << target_count
+    none = [1.0] * size
+    subset_sum = [0.0] * size
+    for probs in pools:
+        for subset in range(1, size):
+            low = subset & -subset
+            subset_sum[subset] = subset_sum[subset ^ low] + probs[low.bit_length() - 1]
+            none[subset] *= 1 - subset_sum[subset]
+    return none
+
+
+class SetCollection:
+    """Collecting every target balance from repeated kills/openings of one source. Needs the run context the source was
+    built with, as its pools are walked again for the target balances."""
+
+    def __init__(self, source: Source, targets: List[str]):
+        if len(targets) > MAX_TARGETS:
+            raise ValueError(f"{len(targets)} targets is too many, the work doubles per target. At most {MAX_TARGETS}.")
+        self.source = source
+        self.targets = list(dict.fromkeys(targets))
+
+        if isinstance(source, drops.InteractiveObjectSource):
+            self.none = [0.0] * (1 << len(self.targets))
+            for config_source, probability in source.configuration_sources:
+                config_none = none_dropped(pool_target_probs(config_source.pool_list, self.targets), len(self.targets))
+                self.none = [n + float(probability) * c for n, c in zip(self.none, config_none)]
+        else:
+            self.none = none_dropped(pool_target_probs(source.pool_list, self.targets), len(self.targets))
+        self.signs = [-1 if bin(subset).count('1') % 2 else 1 for subset in range(len(self.none))]
+
+    def chance_per_kill(self) -> List[float]:
+        """Chance of each target from one kill"""
+        return [1 - self.none[1 << i] for i in range(len(self.targets))]
+
+    def chance_complete(self, kills: int) -> float:
+        chance = sum(sign * none ** kills for sign, none in zip(self.signs, self.none))
+        return min(1.0, max(0.0, chance))  # Cancellation can leave it a hair outside
+
+    def cdf(self, kill_counts: List[int]) -> List[float]:
+        return [self.chance_complete(n) for n in kill_counts]
+
+    def expected_kills(self) -> float:
+        """Infinite if any target can't drop from the source"""
+        if any(self.none[1 << i] >= 1 for i in range(len(self.targets))):
+            return float('inf')
+        return sum(-sign / (1 - none) for sign, none in zip(self.signs[1:], self.none[1:]))
+
+    def percentile_kills(self, probability: float, max_kills: int = 10 ** 9) -> Optional[int]:
+        """Fewest kills with at least the given chance of having the full set. None if that takes more than max_kills."""
+        if self.chance_complete(max_kills) < probability:
+            return None
+        hi = 1
+        while self.chance_complete(hi) < probability:
+            hi *= 2
+        lo = hi // 2 + 1 if hi > 1 else 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.chance_complete(mid) >= probability:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def log_summary(self, kill_counts: List[int] = (10, 50, 100, 200, 500, 1000)) -> None:
+        drops.Log(f"{self.source.name}, collecting {len(self.targets)} balances: expected kills {self.expected_kills():.1f}")
+        for target, chance in zip(self.targets, self.chance_per_kill()):
+            drops.Log(f"    {target}: {chance:.4%} per kill")
+        drops.Log("    " + ', '.join(f"{n} kills {p:.2%}" for n, p in zip(kill_counts, self.cdf(kill_counts))))
+        drops.Log("    " + ', '.join(f"{p:.0%} by {self.percentile_kills(p)}" for p in (0.5, 0.9, 0.99)))
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _TARGETS: List[str] = []  # Balance paths as in balances.json. Empty for the source's 4 likeliest Legendary+ drops.
+
+    balance_ref = drops.load_balance_ref(_BALANCE_REF_PATH)
+    drops.set_live_run_context(balance_ref, lambda inv_bal: False)
+    drops.LoadPackage('Helios_UranusArena')
+
+    source = drops.ItemPoolListSource('Uranus', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 6 + [
+        'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100'])
+    targets = _TARGETS or sorted([path for path in source.balance_probs
+                                  if drops.Rarity(balance_ref.get(path, [0, 11])[0]).category == 'Legendary+'],
+                                 key=lambda path: -source.balance_probs[path])[:4]
+    SetCollection(source, targets).log_summary()
@@ -0,0 +1,140 @@
+"""Inverted index of where each InventoryBalanceDefinition drops from.
+
+Run `pyexec drop_index.py` to walk every ItemPoolListDefinition, InteractiveObjectLootListDefinition and ItemPoolDefinition in the
+currently loaded packages and save the index. Load more packages first to cover more maps. Afterwards, DropIndex.load and lookup
+give the ranked sources of a balance without touching the loot graph again, offline too.
+"""
+import json
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+try:
+    from unrealsdk import FindAll
+except ImportError:  # Only needed for building, loading works offline
+    FindAll = None
+
+INDEX_VERSION = 1
+
+
+@dataclass
+class DropLocation:
+    source_path: str
+    source_kind: str  # 'ItemPoolListDefinition', 'InteractiveObjectLootListDefinition' or 'ItemPoolDefinition'
+    expected_drops: float  # Expected copies of the balance per kill/opening. Same as the chance of one when it's small.
+    provenance: List[str]  # Pools leading to the balance on its most likely route, outermost first
+
+
+class DropIndexBuilder:
+    """Walks sources one at a time over the run's PoolGraph, so pools shared between sources are only read once. Has the same
+    evaluate_steps interface as sources, so it can be run in the background with TimeSlicedRunner."""
+
+    def __init__(self, name: str = 'Drop index', source_kinds: Tuple[str, ...] = ('ItemPoolListDefinition',
+                                                                                  'InteractiveObjectLootListDefinition',
+                                                                                  'ItemPoolDefinition')):
+        self.name = name
+        self.sources: List[Tuple[str, drops.UObject]] = []
+        for kind in source_kinds:
+            self.sources += [(kind, obj) for obj in FindAll(kind)[1:]]  # First is the default object
+        # balance path: source path: [kind, expected drops, best route probability, provenance]
+        self.locations: Dict[str, Dict[str, list]] = {}
+
+    def step_count(self) -> int:
+        return len(self.sources)
+
+    def evaluate(self) -> None:
+        for _ in self.evaluate_steps():
+            pass
+
+    def evaluate_steps(self) -> Iterator[None]:
+        for kind, obj in self.sources:
+            source_path = drops.path_name(obj)
+            if kind == 'ItemPoolListDefinition':
+                self.add_pool_infos(kind, source_path, drops.LootSource.item_pools_from_item_pool_list_def(obj), Fraction(1))
+            elif kind == 'InteractiveObjectLootListDefinition':
+                for loot_config, config_probability in zip(obj.LootData, drops.loot_config_probabilities(obj.LootData)):
+                    if config_probability > 0:
+                        self.add_pool_infos(kind, source_path, loot_config.ItemAttachments, config_probability)
+            else:
+                self.add_pool(kind, source_path, obj, Fraction(1), drops.pool_quantity(obj))
+            yield
+
+    def add_pool_infos(self, kind: str, source_path: str, pool_infos: List[drops.ItemPoolInfo], scale: Fraction) -> None:
+        for pool_info in pool_infos:
+            if pool_info.ItemPool:
+                quantity = drops.pool_quantity(pool_info.ItemPool)
+                self.add_pool(kind, source_path, pool_info.ItemPool, scale * drops.eval_prob_item_pool_info(pool_info), quantity)
+
+    def add_pool(self, kind: str, source_path: str, item_pool_def: drops.ItemPoolDefinition, probability: Fraction,
+                 quantity: int = 1) -> None:
+        if probability == 0:
+            return
+        graph = drops.pool_graph()
+        pool_path = drops.path_name(item_pool_def)
+        flow = graph.flow([(graph.add_pool(item_pool_def), probability)])
+        for balance_id, mass in flow.mass.items():
+            balance_path = graph.balance_paths[balance_id]
+            location = self.locations.setdefault(balance_path, {}).get(source_path)
+            if location is None:
+                location = self.locations[balance_path][source_path] = [kind, Fraction(0), Fraction(0), []]
+            location[1] += mass * quantity
+            best_probability = flow.best[~balance_id][0]
+            if best_probability > location[2]:
+                location[2] = best_probability
+                location[3] = flow.provenance(graph, balance_id, pool_path)
+
+    def save(self, path: str) -> None:
+        index = {
+            balance_path: sorted([[source_path, kind, float(expected), provenance]
+                                  for source_path, (kind, expected, _, provenance) in sources.items()],
+                                 key=lambda location: -location[2])
+            for balance_path, sources in self.locations.items()
+        }
+        with open(path, 'w') as file:
+            json.dump({'version': INDEX_VERSION, 'game_stage': drops._GAME_STAGE, 'playthrough': drops._PLAYTHROUGH,
+                       'index': index}, file, separators=(',', ':'))
+
+
+class DropIndex:
+    """Saved drop index. Locations are stored ranked, so lookups are a dict access."""
+
+    def __init__(self, index: Dict[str, List[list]], game_stage: int, playthrough: int):
+        self.index = index
+        self.game_stage = game_stage
+        self.playthrough = playthrough
+
+    @classmethod
+    def load(cls, path: str) -> 'DropIndex':
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"Drop index version {data.get('version')} not supported, expected {INDEX_VERSION}")
+        return cls(data['index'], data['game_stage'], data['playthrough'])
+
+    def lookup(self, balance_path: str, source_kinds: Optional[Tuple[str, ...]] = None,
+               top: Optional[int] = None) -> List[DropLocation]:
+        """Best sources for the balance first. Empty if nothing loaded at build time drops it."""
+        locations = [DropLocation(*location) for location in self.index.get(balance_path, [])
+                     if source_kinds is None or location[1] in source_kinds]
+        return locations[:top] if top is not None else locations
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _INDEX_PATH = 'Mods/WD/drop_index.json'
+    _TICK_BUDGET_MS: Optional[float] = 5  # None to build in one go, freezing the game until done
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), lambda inv_bal: False)
+
+    builder = DropIndexBuilder()
+    if _TICK_BUDGET_MS is None:
+        builder.evaluate()
+        builder.save(_INDEX_PATH)
+    else:
+        drops.TimeSlicedRunner([builder], _TICK_BUDGET_MS, on_complete=lambda _: builder.save(_INDEX_PATH)).start()
@@ -26,14 +26,26 @@
         - Mutually exclusive flag?
 
     """
+import heapq
 import json
-import subprocess
+import time
+from array import array
 from dataclasses import dataclass
 from enum import Enum
 from fractions import Fraction
-from typing import Any, Callable, Dict, List, Optional, Tuple, cast
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Tuple, Union, cast
 
-from unrealsdk import FindObject, GetEngine, LoadPackage, Log, UClass, UObject
+try:
+    from unrealsdk import FindObject, GetEngine, LoadPackage, Log, RemoveHook, RunHook, UClass, UObject
+except ImportError:  # Running offline from a snapshot, see snapshot.py. Anything touching live objects is unavailable.
+    FindObject = GetEngine = LoadPackage = RemoveHook = RunHook = UClass = None
+    Log = print
+    UObject = Any
+
+try:
+    from Mods.WD.exporters import ClipboardExporter, Exporter, LogExporter, MultiExporter
+except ImportError:
+    from exporters import ClipboardExporter, Exporter, LogExporter, MultiExporter
 
 
 class ItemType(Enum):
@@ -80,6 +92,12 @@ class Rarity(Enum):
             self.category = 'Legendary+'
 
 
+@dataclass
+class OfflineObject:
+    """Stand-in for a UObject rebuilt from a snapshot file. The engine only ever needs its path name."""
+    path: str
+
+
 @dataclass
 class InventoryBalanceDefinition:
     pass
@@ -112,6 +130,12 @@ class AttributeInitializationData:
     BaseValueScaleConstant: float
 
 
+@dataclass
+class EvaluatedInitializationData(AttributeInitializationData):
+    """Init data with its value already evaluated in game for one game stage/playthrough. None if never evaluated."""
+    value: Optional[Fraction]
+
+
 @dataclass
 class BalancedInventoryData:
     ItmPoolDefinition: 'ItemPoolDefinition'
@@ -129,20 +153,10 @@ class ItemPoolDefinition:
     bEligibleForUncommonWeightMultiplier: bool
 
 
-@dataclass
-class ItemPoolDefinitionWrapper:
-    item_pool_definition: ItemPoolDefinition
-    probability: Fraction
-    cumulative_probability: Fraction
-    parents: List['ItemPoolDefinitionWrapper']
-
-
 @dataclass
 class InventoryBalanceDefinitionWrapper:
+    """What success definitions get to look at. One per distinct balance, routes to it are in PoolGraph."""
     inventory_balance_definition: InventoryBalanceDefinition
-    probability: Fraction
-    cumulative_probability: Fraction
-    parents: List[ItemPoolDefinitionWrapper]
     rarity: Rarity
     item_type: ItemType
 
@@ -223,11 +237,157 @@ class AIPawnBalanceDefinition:
     DefaultItemPoolList: List[ItemPoolInfo]
 
 
+SuccessDef = Callable[[InventoryBalanceDefinitionWrapper], bool]
+
+# Run context, set through set_run_context before any sources are evaluated
+_PC: Optional[UObject] = None
+_GAME_STAGE: int = 0
+_PLAYTHROUGH: int = 0
+_UNCOMMON_WEIGHT_MULT: Fraction = Fraction(1)
+_BALANCE_REF: Dict[str, List[int]] = {}
+_SUCCESS_DEF: Optional[Callable[[InventoryBalanceDefinitionWrapper], bool]] = None
+
+
+def set_run_context(pc: Optional[UObject], game_stage: int, playthrough: int, uncommon_weight_mult: Fraction,
+                    balance_ref: Dict[str, List[int]], success_def: Callable[[InventoryBalanceDefinitionWrapper], bool]) -> None:
+    """Sets the globals the engine evaluates against. pc is None when running offline from a snapshot."""
+    global _PC, _GAME_STAGE, _PLAYTHROUGH, _UNCOMMON_WEIGHT_MULT, _BALANCE_REF, _SUCCESS_DEF
+    _PC = pc
+    _GAME_STAGE = game_stage
+    _PLAYTHROUGH = playthrough
+    _UNCOMMON_WEIGHT_MULT = uncommon_weight_mult
+    _BALANCE_REF = balance_ref
+    _SUCCESS_DEF = success_def
+    _EVAL_CACHE.clear()
+
+
+def set_numeric_mode(mode: 'NumericMode') -> None:
+    """Backend used for LootSource.k_successes"""
+    global _NUMERIC_MODE
+    _NUMERIC_MODE = mode
+
+
+DEFAULT_SUCCESS_NAME = 'Success'
+
+
+def rarity_item_type_grid(rarities: List[Rarity] = tuple(Rarity), item_types: List[ItemType] = tuple(ItemType)) \
+        -> Dict[str, SuccessDef]:
+    """Named success definitions for every rarity/item type pair, for passing as success_defs"""
+    return {f"{rarity.name} {item_type.name}": mask_success_def(rarity_item_type_bit(rarity, item_type))
+            for rarity in rarities for item_type in item_types}
+
+
+def rarity_item_type_bit(rarity: Rarity, item_type: ItemType) -> int:
+    """Bit of a rarity/item type pair in reachability and success masks"""
+    return 1 << (rarity.value * len(ItemType) + item_type.value)
+
+
+def rarity_item_type_mask(rarities: List[Rarity] = tuple(Rarity), item_types: List[ItemType] = tuple(ItemType)) -> int:
+    """Mask of every pair of the given rarities and item types"""
+    mask = 0
+    for rarity in rarities:
+        for item_type in item_types:
+            mask |= rarity_item_type_bit(rarity, item_type)
+    return mask
+
+
+def mask_success_def(mask: int) -> SuccessDef:
+    """Success definition for the rarity/item type pairs in the mask. Unlike a lambda, the engine can see what it looks at,
+    so pools that can't reach any of the pairs are skipped without walking them, see PoolGraph."""
+    def success_def(inv_bal: InventoryBalanceDefinitionWrapper) -> bool:
+        return bool(rarity_item_type_bit(inv_bal.rarity, inv_bal.item_type) & mask)
+    success_def.rarity_item_type_mask = mask
+    return success_def
+
+
+def set_live_run_context(balance_ref: Dict[str, List[int]], success_def: Callable[[InventoryBalanceDefinitionWrapper], bool]) -> None:
+    """Run context from the currently loaded character"""
+    pc = cast(UObject, GetEngine().GamePlayers[0].Actor)
+    game_stage = pc.Pawn.GetGameStage()
+    playthrough = pc.GetCurrentPlaythrough() + 1
+    balance_mod_p3 = FindObject('BalanceModifierDefinition', 'GD_Playthrough3Tuning.Balance.BalanceMod_PT3')
+    uncommon_weight_mult = Fraction(balance_mod_p3.GetUncommonChestItemPoolWeightMultiplier(game_stage)).limit_denominator(1000000)
+    set_run_context(pc, game_stage, playthrough, uncommon_weight_mult, balance_ref, success_def)
+
+
+def load_balance_ref(path: str, use_mmap: bool = False):
+    """balances.json as a dict, or the compact binary reference from balance_ref.py, which loads lazily"""
+    if path.endswith('.json'):
+        with open(path, "r") as file:
+            return json.load(file)
+    try:
+        from Mods.WD.balance_ref import BalanceRef
+    except ImportError:
+        from balance_ref import BalanceRef
+    return BalanceRef(path, use_mmap)
+
+
 def path_name(obj):
+    if isinstance(obj, OfflineObject):
+        return obj.path
     return UClass.PathName(obj)
 
 
+class EvalCache:
+    """Per-run cache of evaluated weights. Pools and init data are shared all over the loot graph, so without this the same
+    sub-pools get re-evaluated many times over. Keys include the game stage so a cache can't leak values across characters."""
+
+    def __init__(self):
+        self.init_data: Dict[Tuple, Fraction] = {}
+        self.pool_weights: Dict[Tuple[str, int, bool], List[Fraction]] = {}
+        self.pool_stage_met: Dict[Tuple[str, int], bool] = {}
+        self.pool_quantity: Dict[Tuple[str, int], int] = {}
+        self.pool_infos: Dict[Tuple, Tuple[Fraction, int, Optional[int]]] = {}
+        self.pool_lists: Dict[str, List[ItemPoolInfo]] = {}
+        self.graph: Optional['PoolGraph'] = None
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self.init_data.clear()
+        self.pool_weights.clear()
+        self.pool_stage_met.clear()
+        self.pool_quantity.clear()
+        self.pool_infos.clear()
+        self.pool_lists.clear()
+        self.graph = None
+        self.hits = 0
+        self.misses = 0
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = 0 if total == 0 else self.hits / total
+        report = f"Eval cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), " \
+                 f"{len(self.pool_weights)} pools, {len(self.init_data)} init data"
+        return report if self.graph is None else f"{report}. {self.graph.report()}"
+
+
+_EVAL_CACHE = EvalCache()
+
+
+def obj_key(obj) -> Optional[str]:
+    return path_name(obj) if obj else None
+
+
+def init_data_key(attrib_init_data: AttributeInitializationData) -> Tuple:
+    """Identifies init data by value, live or offline"""
+    return (attrib_init_data.BaseValueConstant, obj_key(attrib_init_data.BaseValueAttribute),
+            obj_key(attrib_init_data.InitializationDefinition), attrib_init_data.BaseValueScaleConstant)
+
+
 def eval_init_data(attrib_init_data: AttributeInitializationData):
+    if isinstance(attrib_init_data, EvaluatedInitializationData):
+        if attrib_init_data.value is None:
+            raise ValueError(f"Snapshot has no value for {attrib_init_data} at game stage {_GAME_STAGE}")
+        return attrib_init_data.value
+
+    key = init_data_key(attrib_init_data) + (_GAME_STAGE,)
+    cached = _EVAL_CACHE.init_data.get(key)
+    if cached is not None:
+        _EVAL_CACHE.hits += 1
+        return cached
+    _EVAL_CACHE.misses += 1
+
     init_data_tuple = (attrib_init_data.BaseValueConstant, attrib_init_data.BaseValueAttribute,
                        attrib_init_data.InitializationDefinition, attrib_init_data.BaseValueScaleConstant)
 
@@ -239,25 +399,71 @@ def eval_init_data(attrib_init_data: AttributeInitializationData):
                    * attrib_init_data.BaseValueScaleConstant
         except AttributeError:
             pass
-    return Fraction.from_float(prob).limit_denominator(10000)
+    result = Fraction.from_float(prob).limit_denominator(10000)
+    _EVAL_CACHE.init_data[key] = result
+    return result
+
+
+def pool_game_stage_met(item_pool_def: ItemPoolDefinition) -> bool:
+    """Whether the pool's MinGameStageRequirement is satisfied at the current game stage"""
+    if not item_pool_def.MinGameStageRequirement:
+        return True
+    key = (path_name(item_pool_def), _GAME_STAGE)
+    met = _EVAL_CACHE.pool_stage_met.get(key)
+    if met is not None:
+        _EVAL_CACHE.hits += 1
+        return met
+    _EVAL_CACHE.misses += 1
+    met = _GAME_STAGE >= item_pool_def.MinGameStageRequirement.GetValue(_PC)[0]
+    _EVAL_CACHE.pool_stage_met[key] = met
+    return met
+
+
+def pool_quantity(item_pool_def: ItemPoolDefinition) -> int:
+    """Items the pool rolls when dropped from an ItemPoolInfo. Pools without a usable Quantity roll once."""
+    if not item_pool_def.Quantity:
+        return 1
+    key = (path_name(item_pool_def), _GAME_STAGE)
+    quantity = _EVAL_CACHE.pool_quantity.get(key)
+    if quantity is not None:
+        _EVAL_CACHE.hits += 1
+        return quantity
+    _EVAL_CACHE.misses += 1
+    # An unset Quantity evaluates to 0, but the game still drops one item from those
+    quantity = max(1, round(eval_init_data(item_pool_def.Quantity)))
+    _EVAL_CACHE.pool_quantity[key] = quantity
+    return quantity
+
+
+def pool_weights(item_pool_def: ItemPoolDefinition) -> List[Fraction]:
+    """Weights of each of the pool's BalancedItems, in order. Evaluated once per pool per run."""
+    elig_uncommon_weight = item_pool_def.bEligibleForUncommonWeightMultiplier
+    key = (path_name(item_pool_def), _GAME_STAGE, elig_uncommon_weight)
+    weights = _EVAL_CACHE.pool_weights.get(key)
+    if weights is not None:
+        _EVAL_CACHE.hits += 1
+        return weights
+    _EVAL_CACHE.misses += 1
+    weights = [eval_prob_balanced_item(balanced_item, elig_uncommon_weight) for balanced_item in item_pool_def.BalancedItems]
+    _EVAL_CACHE.pool_weights[key] = weights
+    return weights
 
 
 def eval_prob_balanced_item(balanced_item: BalancedInventoryData, elig_uncommon_weight: bool):
-    """Have to do recursive here to find out if any subpools have 0 probability, which changes weights at the higher level."""
+    """Sub-pools with 0 total weight change weights at the higher level, so those get checked (cached) here too."""
     if not balanced_item.bDropOnDeath:
         return Fraction(0)
 
     if balanced_item.ItmPoolDefinition:
         item_pool_def = balanced_item.ItmPoolDefinition
-        if item_pool_def.MinGameStageRequirement and _GAME_STAGE < item_pool_def.MinGameStageRequirement.GetValue(_PC)[0]:
+        if not pool_game_stage_met(item_pool_def):
             return Fraction(0)
-        if sum([eval_prob_balanced_item(balanced_item, elig_uncommon_weight)
-             for balanced_item in balanced_item.ItmPoolDefinition.BalancedItems], Fraction(0)) == 0:
+        if sum(pool_weights(item_pool_def), Fraction(0)) == 0:
             return Fraction(0)
 
     probability = eval_init_data(balanced_item.Probability)
 
-    if elig_uncommon_weight and path_name(balanced_item.Probability.InitializationDefinition) == 'GD_Balance.Weighting.Weight_2_Uncommon':
+    if elig_uncommon_weight and obj_key(balanced_item.Probability.InitializationDefinition) == 'GD_Balance.Weighting.Weight_2_Uncommon':
         probability = probability * _UNCOMMON_WEIGHT_MULT
 
     return probability
@@ -266,24 +472,419 @@ def eval_prob_balanced_item(balanced_item: BalancedInventoryData, elig_uncommon_
 def eval_prob_item_pool_info(item_pool_info: ItemPoolInfo):
 
     probability = eval_init_data(item_pool_info.PoolProbability)
-    if item_pool_info.ItemPool:
-        item_pool_def = item_pool_info.ItemPool
-        if item_pool_def.MinGameStageRequirement and _GAME_STAGE < item_pool_def.MinGameStageRequirement.GetValue(_PC)[0]:
-            probability = Fraction(0)
+    if item_pool_info.ItemPool and not pool_game_stage_met(item_pool_info.ItemPool):
+        probability = Fraction(0)
     return probability
 
 
+class NumericMode(Enum):
+    """Exact is the reference, and slow with lots of pools. Float is fast. Interval is float with rigorous error bounds."""
+    Exact = 'exact'
+    Float = 'float'
+    Interval = 'interval'
+
+
+_NUMERIC_MODE = NumericMode.Exact
+
+# Relative rounding error allowed per float operation in interval mode. Double the machine epsilon to stay conservative.
+_INTERVAL_EPS = 2 * 2.0 ** -52
+
+
+@dataclass(frozen=True)
+class Interval:
+    """Closed interval holding the true value of a probability computed in floating point"""
+    lo: float
+    hi: float
+
+    @classmethod
+    def from_value(cls, value) -> 'Interval':
+        if isinstance(value, Interval):
+            return value
+        f = float(value)
+        if isinstance(value, Fraction) and Fraction(f) == value:
+            return Interval(f, f)
+        return Interval(f * (1 - _INTERVAL_EPS), f * (1 + _INTERVAL_EPS))
+
+    @classmethod
+    def _widen(cls, lo: float, hi: float) -> 'Interval':
+        return Interval(lo - abs(lo) * _INTERVAL_EPS, hi + abs(hi) * _INTERVAL_EPS)
+
+    def __add__(self, other) -> 'Interval':
+        other = Interval.from_value(other)
+        return Interval._widen(self.lo + other.lo, self.hi + other.hi)
+
+    __radd__ = __add__
+
+    def __sub__(self, other) -> 'Interval':
+        other = Interval.from_value(other)
+        return Interval._widen(self.lo - other.hi, self.hi - other.lo)
+
+    def __rsub__(self, other) -> 'Interval':
+        return Interval.from_value(other) - self
+
+    def __mul__(self, other) -> 'Interval':
+        other = Interval.from_value(other)
+        products = [self.lo * other.lo, self.lo * other.hi, self.hi * other.lo, self.hi * other.hi]
+        return Interval._widen(min(products), max(products))
+
+    __rmul__ = __mul__
+
+    def __float__(self) -> float:
+        return (self.lo + self.hi) / 2
+
+    @property
+    def error(self) -> float:
+        return (self.hi - self.lo) / 2
+
+    def __str__(self) -> str:
+        return f"{float(self):.6%} \u00b1 {self.error:.1e}"
+
+
+def k_successes_float(probs: List[float], max_k: int = 4) -> List[float]:
+    """Chance of 0..max_k-1 successes plus max_k or more. Only keeps max_k + 1 columns, so it's O(n * max_k)."""
+    dist = [1.0] + [0.0] * max_k
+    for p in probs:
+        q = 1 - p
+        dist[max_k] = dist[max_k] + dist[max_k - 1] * p
+        for k in range(max_k - 1, 0, -1):
+            dist[k] = dist[k] * q + dist[k - 1] * p
+        dist[0] = dist[0] * q
+    return dist
+
+
+def k_successes_interval(probs: List[Fraction], max_k: int = 4) -> List[Interval]:
+    """Same as k_successes_float, but every value carries bounds on its accumulated rounding error"""
+    dist = [Interval(1.0, 1.0)] + [Interval(0.0, 0.0)] * max_k
+    for prob in probs:
+        p = Interval.from_value(prob)
+        q = 1 - p
+        dist[max_k] = dist[max_k] + dist[max_k - 1] * p
+        for k in range(max_k - 1, 0, -1):
+            dist[k] = dist[k] * q + dist[k - 1] * p
+        dist[0] = dist[0] * q
+    return dist
+
+
+def binomial_truncated(p, quantity: int, max_k: int = 4) -> List:
+    """Successes from quantity independent rolls of chance p, max_k or more lumped together. Works for any numeric mode."""
+    q = 1 - p
+    dist = []
+    coefficient = 1  # quantity choose k
+    for k in range(min(quantity, max_k - 1) + 1):
+        term = coefficient
+        for _ in range(k):
+            term = term * p
+        for _ in range(quantity - k):
+            term = term * q
+        dist.append(term)
+        coefficient = coefficient * (quantity - k) // (k + 1)
+    dist += [0 * p] * (max_k - len(dist))
+    dist.append(1 - sum(dist[1:], dist[0]) if quantity >= max_k else 0 * p)
+    return dist
+
+
+def convolve_truncated(a: List, b: List, max_k: int = 4) -> List:
+    """Distribution of the sum of two independent success counts, max_k or more lumped together"""
+    result = [0 * a[0]] * (max_k + 1)
+    for i, p in enumerate(a):
+        for j, q in enumerate(b):
+            result[min(i + j, max_k)] = result[min(i + j, max_k)] + p * q
+    return result
+
+
+def balance_wrapper(inv_bal_def: InventoryBalanceDefinition) -> InventoryBalanceDefinitionWrapper:
+    """Balance with its rarity and item type from the balance reference, Other if it isn't in there"""
+    rarity_item_type = _BALANCE_REF.get(path_name(inv_bal_def)) or [0, 11]
+    return InventoryBalanceDefinitionWrapper(inv_bal_def, Rarity(rarity_item_type[0]), ItemType(rarity_item_type[1]))
+
+
+@dataclass
+class LeafFlow:
+    """Where probability mass from some root pools ends up"""
+    mass: Dict[int, Fraction]  # Balance id: expected drops
+    # Node (pool id, or ~balance id): (likeliest route's probability, pool before it, index of the node in that pool's row)
+    best: Dict[int, Tuple[Fraction, Optional[int], Optional[int]]]
+
+    def provenance(self, graph: 'PoolGraph', balance_id: int, root_path: str) -> List[str]:
+        """Pool paths on the likeliest route to the balance, outermost first, starting from root_path, the path the
+        route's root pool was added as. Merged nodes have several paths, so each step is named by the path its parent
+        actually references, not the node's first path."""
+        edges = []
+        node = ~balance_id
+        while self.best[node][1] is not None:
+            _, parent, index = self.best[node]
+            edges.append(index)
+            node = parent
+        route = [root_path]
+        for index in reversed(edges[1:]):
+            route.append(graph.child_paths_of(route[-1])[index])
+        return route
+
+
+def union_masks(masks: List[int]) -> int:
+    union = 0
+    for mask in masks:
+        union |= mask
+    return union
+
+
+class SuccessTable:
+    """Success chance of each pool for one tuple of success definitions, filled in as pools are asked for"""
+
+    def __init__(self, graph: 'PoolGraph', success_defs: Tuple[SuccessDef, ...]):
+        self.graph = graph
+        self.success_defs = success_defs
+        self.balance_success: Dict[int, List[bool]] = {}
+        self.pool_success: Dict[int, List[Fraction]] = {}
+        # Pools can only be skipped when every definition says which rarity/item type pairs it can succeed on
+        masks = [getattr(success_def, 'rarity_item_type_mask', None) for success_def in success_defs]
+        self.prune_mask = None if None in masks else union_masks(masks)
+
+    def balance(self, balance_id: int) -> List[bool]:
+        successes = self.balance_success.get(balance_id)
+        if successes is None:
+            inv_bal = self.graph.balance_wrappers[balance_id]
+            successes = self.balance_success[balance_id] = [bool(success_def(inv_bal)) for success_def in self.success_defs]
+        return successes
+
+    def pool(self, pool_id: int) -> List[Fraction]:
+        successes = self.pool_success.get(pool_id)
+        if successes is not None:
+            return successes
+        successes = [Fraction(0)] * len(self.success_defs)
+        if self.prune_mask is not None and not self.graph.reachable[pool_id] & self.prune_mask:
+            self.graph.pruned += 1
+            self.pool_success[pool_id] = successes
+            return successes
+        self.graph.evaluations += 1
+        for child, probability in self.graph.row(pool_id):
+            child_successes = self.pool(child) if child >= 0 else self.balance(~child)
+            for i, child_success in enumerate(child_successes):
+                if child_success:
+                    successes[i] += probability * child_success
+        self.pool_success[pool_id] = successes
+        return successes
+
+
+class PoolGraph:
+    """The loot graph of the current run context, with integer ids and flat arrays instead of a wrapper object per route.
+
+    Pools get ids in the order they finish being added, so children always have lower ids than their parents. Pool i's
+    children are children[child_start[i]:child_start[i + 1]], with pools as their id and balances as ~balance id, and the
+    chance of rolling each in child_probs. Children that can't roll are left out. Routes to a balance aren't stored, see
+    flow and LeafFlow.provenance, only the path each child is referenced by, in child_paths. Built lazily as sources add pools, and shared by all of them.
+
+    Pools are hash-consed: one whose resolved children and chances match an existing pool's, e.g. a DLC copy or an
+    _Uncommon variant, gets that pool's id instead of a node of its own, so its results are shared. Weights are resolved
+    before comparing, game stage requirements and the uncommon multiplier of children included, so only pools that roll
+    the same way are merged. A pool's own game stage requirement is applied by its parent, not part of the node. pool_paths
+    has the first path seen for each node, and child_paths the children as that path references them. A merged path
+    can reference different copies of the same children, so its own child paths are kept in alias_child_paths.
+
+    Each pool also has a mask of the rarity/item type pairs it can drop, from the balance reference, so success tables
+    whose definitions are masks (see mask_success_def) skip pools that can't give a success without going into them."""
+
+    def __init__(self):
+        self.pool_ids: Dict[str, int] = {}
+        self.pool_paths: List[str] = []
+        self.balance_ids: Dict[str, int] = {}
+        self.balance_paths: List[str] = []
+        self.balance_wrappers: List[InventoryBalanceDefinitionWrapper] = []
+        self.balance_bits: List[int] = []  # Rarity/item type bit of each balance
+        self.reachable: List[int] = []  # Rarity/item type pairs each pool can drop
+        self.child_start = array('l', [0])
+        self.children = array('l')
+        self.child_probs: List[Fraction] = []
+        self.child_paths: List[str] = []  # Path each child is referenced by, from the node's first path
+        self.alias_child_paths: Dict[str, List[str]] = {}  # Merged pool path: its child paths, in its node's row order
+        self.node_ids: Dict[Tuple[Tuple[int, Fraction], ...], int] = {}  # Resolved children: pool id
+        self.tables: Dict[Tuple[SuccessDef, ...], SuccessTable] = {}
+        self.evaluations = 0  # Pools whose success chance was computed, over all tables
+        self.merged_pools = 0  # Pool paths that share another's node
+        self.merged_children = 0  # Child entries of those, not stored or evaluated again
+        self.pruned = 0  # Pools skipped as they can't reach anything a success table looks for
+
+    def add_balance(self, inv_bal_def: InventoryBalanceDefinition) -> int:
+        path = path_name(inv_bal_def)
+        balance_id = self.balance_ids.get(path)
+        if balance_id is None:
+            balance_id = self.balance_ids[path] = len(self.balance_paths)
+            self.balance_paths.append(path)
+            inv_bal = balance_wrapper(inv_bal_def)
+            self.balance_wrappers.append(inv_bal)
+            self.balance_bits.append(rarity_item_type_bit(inv_bal.rarity, inv_bal.item_type))
+        return balance_id
+
+    def add_pool(self, item_pool_def: ItemPoolDefinition) -> int:
+        path = path_name(item_pool_def)
+        pool_id = self.pool_ids.get(path)
+        if pool_id is not None:
+            return pool_id
+
+        weights = pool_weights(item_pool_def)
+        total_weight = sum(weights, Fraction(0))
+        row = []
+        child_paths = []
+        for balanced_item, weight in zip(item_pool_def.BalancedItems, weights):
+            if weight == 0:
+                continue
+            if balanced_item.ItmPoolDefinition:
+                row.append((self.add_pool(balanced_item.ItmPoolDefinition), weight / total_weight))
+                child_paths.append(path_name(balanced_item.ItmPoolDefinition))
+            elif balanced_item.InvBalanceDefinition:
+                row.append((~self.add_balance(balanced_item.InvBalanceDefinition), weight / total_weight))
+                child_paths.append(path_name(balanced_item.InvBalanceDefinition))
+
+        key = tuple(row)
+        pool_id = self.node_ids.get(key)
+        if pool_id is not None:
+            self.pool_ids[path] = pool_id
+            self.alias_child_paths[path] = child_paths
+            self.merged_pools += 1
+            self.merged_children += len(row)
+            return pool_id
+
+        pool_id = self.pool_ids[path] = self.node_ids[key] = len(self.pool_paths)
+        self.pool_paths.append(path)
+        self.child_paths.extend(child_paths)
+        reachable = 0
+        for child, probability in row:
+            self.children.append(child)
+            self.child_probs.append(probability)
+            reachable |= self.reachable[child] if child >= 0 else self.balance_bits[~child]
+        self.reachable.append(reachable)
+        self.child_start.append(len(self.children))
+        return pool_id
+
+    def row(self, pool_id: int) -> Iterator[Tuple[int, Fraction]]:
+        for i in range(self.child_start[pool_id], self.child_start[pool_id + 1]):
+            yield self.children[i], self.child_probs[i]
+
+    def child_paths_of(self, path: str) -> List[str]:
+        """Paths the pool at path references its node's children by, in row order"""
+        child_paths = self.alias_child_paths.get(path)
+        if child_paths is None:
+            pool_id = self.pool_ids[path]
+            child_paths = self.child_paths[self.child_start[pool_id]:self.child_start[pool_id + 1]]
+        return child_paths
+
+    def report(self) -> str:
+        return f"Pool graph: {len(self.pool_ids)} pools in {len(self.pool_paths)} nodes, {self.merged_pools} duplicates " \
+               f"merged ({self.merged_children} child entries), {self.evaluations} pool evaluations, {self.pruned} skipped"
+
+    def success_table(self, success_defs: Tuple[SuccessDef, ...]) -> SuccessTable:
+        table = self.tables.get(success_defs)
+        if table is None:
+            table = self.tables[success_defs] = SuccessTable(self, success_defs)
+        return table
+
+    def flow(self, roots: List[Tuple[int, Fraction]]) -> LeafFlow:
+        """Pushes each root's mass down the graph, one pass over the pools reachable from them. Parents have higher ids
+        than their children, so going from the highest id down, a pool has all its mass before it's passed on."""
+        pool_mass: Dict[int, Fraction] = {}
+        flow = LeafFlow({}, {})
+        for pool_id, mass in roots:
+            pool_mass[pool_id] = pool_mass.get(pool_id, Fraction(0)) + mass
+            if mass > flow.best.get(pool_id, (Fraction(0), None, None))[0]:
+                flow.best[pool_id] = (mass, None, None)
+        heap = [-pool_id for pool_id in pool_mass]
+        heapq.heapify(heap)
+        while heap:
+            pool_id = -heapq.heappop(heap)
+            mass = pool_mass.pop(pool_id)
+            route_probability = flow.best[pool_id][0]
+            start = self.child_start[pool_id]
+            for index in range(self.child_start[pool_id + 1] - start):
+                child, probability = self.children[start + index], self.child_probs[start + index]
+                if child >= 0:
+                    if child not in pool_mass:
+                        pool_mass[child] = Fraction(0)
+                        heapq.heappush(heap, -child)
+                    pool_mass[child] += mass * probability
+                else:
+                    flow.mass[~child] = flow.mass.get(~child, Fraction(0)) + mass * probability
+                if route_probability * probability > flow.best.get(child, (Fraction(0), None, None))[0]:
+                    flow.best[child] = (route_probability * probability, pool_id, index)
+        return flow
+
+
+def pool_graph() -> PoolGraph:
+    """The run's graph, started fresh whenever the run context changes"""
+    if _EVAL_CACHE.graph is None:
+        _EVAL_CACHE.graph = PoolGraph()
+    return _EVAL_CACHE.graph
+
+
+def resolve_pool_info(pool: ItemPoolInfo) -> Tuple[Fraction, int, Optional[int]]:
+    """Chance the ItemPoolInfo's pool drops, how many times it rolls, and its id in the run's PoolGraph, None if it can't
+    drop. Cached by pool and PoolProbability, so an ItemPoolInfo shared by many sources is resolved once."""
+    key = (obj_key(pool.ItemPool), init_data_key(pool.PoolProbability), _GAME_STAGE)
+    resolved = _EVAL_CACHE.pool_infos.get(key)
+    if resolved is not None:
+        _EVAL_CACHE.hits += 1
+        return resolved
+    _EVAL_CACHE.misses += 1
+    probability = eval_prob_item_pool_info(pool)
+    quantity = pool_quantity(pool.ItemPool) if pool.ItemPool else 1
+    pool_id = pool_graph().add_pool(pool.ItemPool) if pool.ItemPool and probability > 0 else None
+    resolved = _EVAL_CACHE.pool_infos[key] = (probability, quantity, pool_id)
+    return resolved
+
+
+def item_pool_list(ipld_path: str) -> List[ItemPoolInfo]:
+    """ItemPoolInfos of an ItemPoolListDefinition and its included lists, looked up once per run"""
+    pool_list = _EVAL_CACHE.pool_lists.get(ipld_path)
+    if pool_list is None:
+        ipld = cast(ItemPoolListDefinition, FindObject('ItemPoolListDefinition', ipld_path))
+        if not ipld:
+            raise ValueError(f"Could not find ItemPoolListDefinition {ipld_path}, is its package loaded?")
+        pool_list = _EVAL_CACHE.pool_lists[ipld_path] = LootSource.item_pools_from_item_pool_list_def(ipld)
+    return pool_list
+
+
 class LootSource:
     """Loot source must represent a series of independent loot pools.
     Chest configurations need to be their own loot sources, aggregated later"""
 
-    def __init__(self, name: str, pool_list: List[ItemPoolInfo]):
+    def __init__(self, name: str, pool_list: List[ItemPoolInfo],
+                 success_defs: Optional[Dict[str, SuccessDef]] = None, evaluate: bool = True):
         self.name = name
         self.pool_list = pool_list
+        self.success_defs = success_defs or {DEFAULT_SUCCESS_NAME: _SUCCESS_DEF}
 
-        # TODO: Retain extra info about the source. Currently only have pool list and final result.
         # TODO: Could wrap ItemPoolInfo to add the additional stuff
-        self.success_dist = self.dist_from_pool_list()
+        self.success_dists: Dict[str, List[Fraction]] = {}
+        self.success_dist: Optional[List[Fraction]] = None
+        self._balance_probs: Optional[Dict[str, Fraction]] = None
+        self._balance_roots: Optional[Tuple[PoolGraph, List[Tuple[int, Fraction]]]] = None
+        if evaluate:
+            self.evaluate()
+
+    @property
+    def balance_probs(self) -> Dict[str, Fraction]:
+        """Expected drops of each balance path per kill/opening. Only worked out when asked for, exporting doesn't need it."""
+        if self._balance_probs is None:
+            if self._balance_roots is None:
+                raise ValueError(f"{self.name} hasn't been evaluated, balance_probs needs evaluate() or a cached result first")
+            graph, roots = self._balance_roots
+            self._balance_probs = {graph.balance_paths[balance_id]: mass for balance_id, mass in graph.flow(roots).mass.items()}
+        return self._balance_probs
+
+    @balance_probs.setter
+    def balance_probs(self, balance_probs: Dict[str, Fraction]) -> None:
+        self._balance_probs = balance_probs
+
+    def evaluate(self) -> None:
+        for _ in self.evaluate_steps():
+            pass
+
+    def evaluate_steps(self) -> Iterator[None]:
+        """Evaluates the source one pool per step, so the work can be spread over game ticks. See TimeSlicedRunner."""
+        self.success_dists = yield from self.dists_from_pool_list()
+        self.success_dist = next(iter(self.success_dists.values()))
+
+    def step_count(self) -> int:
+        return len(self.pool_list)
 
     @classmethod
     def item_pools_from_item_pool_list_def(cls, item_pool_list_def: ItemPoolListDefinition) -> List[ItemPoolInfo]:
@@ -295,49 +896,33 @@ class LootSource:
         return item_pools
 
     @classmethod
-    def inv_balances_from_pool(cls, in_item_pool: ItemPoolDefinitionWrapper) -> List[InventoryBalanceDefinitionWrapper]:
-        """Recursive function to get all terminal inventory balances along with their probability of rolling from a given pool"""
-        elig_uncommon_weight = in_item_pool.item_pool_definition.bEligibleForUncommonWeightMultiplier
-        total_weight = sum([eval_prob_balanced_item(balanced_item, elig_uncommon_weight)
-                            for balanced_item in in_item_pool.item_pool_definition.BalancedItems], Fraction(0))
-        inv_balance_defs: List[InventoryBalanceDefinitionWrapper] = []
-
-        for balanced_item in in_item_pool.item_pool_definition.BalancedItems:
-            weight = eval_prob_balanced_item(balanced_item, elig_uncommon_weight)
-            probability = 0 if total_weight == 0 else weight / total_weight
-            cumulative_probability = in_item_pool.cumulative_probability * probability
-            if cumulative_probability == 0:
-                continue  # No sense continuing with zero probability
-
-            if balanced_item.ItmPoolDefinition:
-                item_pool = ItemPoolDefinitionWrapper(
-                    item_pool_definition=balanced_item.ItmPoolDefinition,
-                    probability=probability,
-                    cumulative_probability=cumulative_probability,
-                    parents=in_item_pool.parents + [in_item_pool]
-                )
-                inv_balance_defs += cls.inv_balances_from_pool(item_pool)
-
-            elif balanced_item.InvBalanceDefinition:
-                rarity_item_type = _BALANCE_REF.get(path_name(balanced_item.InvBalanceDefinition))
-                if not rarity_item_type:
-                    rarity_item_type = [0, 11]
-                rarity = Rarity(rarity_item_type[0])
-                item_type = ItemType(rarity_item_type[1])
-
-                inv_bal_def = InventoryBalanceDefinitionWrapper(
-                    inventory_balance_definition=balanced_item.InvBalanceDefinition,
-                    probability=probability,
-                    cumulative_probability=cumulative_probability,
-                    parents=in_item_pool.parents + [in_item_pool],
-                    rarity=rarity,
-                    item_type=item_type
-                )
-                inv_balance_defs += [inv_bal_def]
-        return inv_balance_defs
+    def k_successes(cls, probs: List[Fraction], quantities: Optional[List[int]] = None) -> List[Fraction]:
+        """Poisson binomial distribution of successes, 4+ lumped together. Backend picked by _NUMERIC_MODE.
+        Pools rolling more than once (quantities) are folded in afterwards as truncated binomials, so extra rolls cost a
+        constant each instead of growing the DP."""
+        quantities = quantities or [1] * len(probs)
+        single = [p for p, quantity in zip(probs, quantities) if quantity == 1]
+        if _NUMERIC_MODE == NumericMode.Float:
+            dist = k_successes_float([float(p) for p in single])
+        elif _NUMERIC_MODE == NumericMode.Interval:
+            dist = k_successes_interval(single)
+        else:
+            dist = cls.k_successes_exact(single)
+
+        for p, quantity in zip(probs, quantities):
+            if quantity == 1:
+                continue
+            if _NUMERIC_MODE == NumericMode.Float:
+                p = float(p)
+            elif _NUMERIC_MODE == NumericMode.Interval:
+                p = Interval.from_value(p)
+            dist = convolve_truncated(dist, binomial_truncated(p, quantity))
+            if _NUMERIC_MODE == NumericMode.Exact:
+                dist = [d.limit_denominator(1000000000) for d in dist]
+        return dist
 
     @classmethod
-    def k_successes(cls, probs: List[Fraction]) -> List[Fraction]:
+    def k_successes_exact(cls, probs: List[Fraction]) -> List[Fraction]:
         if len(probs) < 4:
             probs = probs + [Fraction(0)] * (4 - len(probs))
         n = len(probs)
@@ -358,160 +943,368 @@ class LootSource:
         assert abs(sum(success_list, Fraction(0)).limit_denominator(1000000000) - Fraction(1)) < .00001
         return success_list
 
-    def dist_from_pool_list(self) -> List[Fraction]:
-
-        success_probs_by_pool: List[Fraction] = []
+    def dists_from_pool_list(self) -> Generator[None, None, Dict[str, List[Fraction]]]:
+        """Success chance of each pool from the run's PoolGraph, shared by every success definition and every source using
+        the pool. Definitions get evaluated once per distinct balance. Yields after each pool."""
+        graph = pool_graph()
+        table = graph.success_table(tuple(self.success_defs.values()))
+        success_probs_by_pool: Dict[str, List[Fraction]] = {name: [] for name in self.success_defs}
+        quantities: List[int] = []
+        roots: List[Tuple[int, Fraction]] = []
         for pool in self.pool_list:
-            probability = eval_prob_item_pool_info(pool)
-            item_pool_def_wrap = ItemPoolDefinitionWrapper(
-                item_pool_definition=pool.ItemPool,
-                probability=probability,
-                cumulative_probability=probability,
-                parents=[]
-            )
-            inv_balance_defs = self.inv_balances_from_pool(item_pool_def_wrap)
-            cum_sum = sum([inv_bal.cumulative_probability for inv_bal in inv_balance_defs], Fraction(0))
-            assert abs(cum_sum - probability) < 0.0001 or cum_sum == 0
-            success_probs_by_pool += [sum([inv_bal.cumulative_probability for inv_bal in inv_balance_defs
-                                           if _SUCCESS_DEF(inv_bal)], Fraction(0))]
-
-        success_probs_by_pool = [p for p in success_probs_by_pool if p > 0]
-        return self.k_successes(success_probs_by_pool)
+            probability, quantity, pool_id = resolve_pool_info(pool)
+            quantities.append(quantity)
+            pool_success_probs = [Fraction(0)] * len(self.success_defs)
+            if pool_id is not None:
+                roots.append((pool_id, probability * quantity))
+                pool_success_probs = [probability * p for p in table.pool(pool_id)]
+            for name, p in zip(self.success_defs, pool_success_probs):
+                success_probs_by_pool[name] += [p]
+            yield
+
+        self._balance_roots = (graph, roots)
+        self._balance_probs = None
+        return {name: self.k_successes([p for p in probs if p > 0], [q for p, q in zip(probs, quantities) if p > 0])
+                for name, probs in success_probs_by_pool.items()}
 
 
 class ItemPoolListSource(LootSource):
     """For instantiating from a set of path names for ItemPoolListDefinition"""
 
-    def __init__(self, name: str, ipld_path_names: List[str]):
+    def __init__(self, name: str, ipld_path_names: List[str], success_defs: Optional[Dict[str, SuccessDef]] = None,
+                 evaluate: bool = True):
         pool_list: List[ItemPoolInfo] = []
         for ipld_path in ipld_path_names:
-            ipld = cast(ItemPoolListDefinition, FindObject('ItemPoolListDefinition', ipld_path))
-            pool_list.extend(self.item_pools_from_item_pool_list_def(ipld))
+            pool_list.extend(item_pool_list(ipld_path))
 
-        super().__init__(name, pool_list)
+        super().__init__(name, pool_list, success_defs, evaluate)
 
 
 class CustomItemPoolListSource(LootSource):
     """For instantiating from a custom ListDef - useful for recreating a pawn balance that has its DefaultItemPoolList defined"""
 
-    def __init__(self, name: str, ipi_args_list: List[ItemPoolInfoPathArgs], ipld_path_names: List[str]):
+    def __init__(self, name: str, ipi_args_list: List[ItemPoolInfoPathArgs], ipld_path_names: List[str],
+                 success_defs: Optional[Dict[str, SuccessDef]] = None, evaluate: bool = True):
         pool_list: List[ItemPoolInfo] = []
 
         for ipi_args in ipi_args_list:
             pool_list += [ItemPoolInfo.from_paths(ipi_args)]
 
         for ipld_path in ipld_path_names:
-            ipld = cast(ItemPoolListDefinition, FindObject('ItemPoolListDefinition', ipld_path))
-            pool_list.extend(self.item_pools_from_item_pool_list_def(ipld))
+            pool_list.extend(item_pool_list(ipld_path))
+
+        super().__init__(name, pool_list, success_defs, evaluate)
+
+
+def loot_config_eligible(loot_config: LootConfigurationData) -> bool:
+    """Whether every attachment pool meets its MinGameStageRequirement. Checks are cached per pool."""
+    return all(pool_game_stage_met(attachment.ItemPool) for attachment in loot_config.ItemAttachments if attachment.ItemPool)
 
-        super().__init__(name, pool_list)
+
+def loot_config_probabilities(loot_configs: List[LootConfigurationData]) -> List[Fraction]:
+    """Chance of each configuration being used. When an attachment's pool is above the game stage, opening the object picks
+    another configuration, so ineligible ones get no weight. If none are eligible, weights are used as they are."""
+    weights = [eval_init_data(lc.Weight) for lc in loot_configs]
+    eligible_weights = [weight if loot_config_eligible(lc) else Fraction(0) for lc, weight in zip(loot_configs, weights)]
+    if sum(eligible_weights, Fraction(0)) > 0:
+        weights = eligible_weights
+    total_weight = sum(weights, Fraction(0))
+    return [Fraction(0) if total_weight == 0 else weight / total_weight for weight in weights]
 
 
 class InteractiveObjectSource:
     """IO loot lists have separate configurations that are mutually exclusive. New base class that will create multiple LootSource
     instances and aggregate their results."""
 
-    # TODO: Opening chests must check to make sure game stage requirements are met for all attachment points. New config chosen if not.
-    def __init__(self, name: str, loot_configs: List[LootConfigurationData]):
+    def __init__(self, name: str, loot_configs: List[LootConfigurationData],
+                 success_defs: Optional[Dict[str, SuccessDef]] = None, evaluate: bool = True):
         self.name = name
+        self.success_defs = success_defs or {DEFAULT_SUCCESS_NAME: _SUCCESS_DEF}
+        self.loot_configs = loot_configs
         self.configuration_sources: List[Tuple[LootSource, Fraction]] = []  # To keep track of probability of each config
-        total_weight = sum([eval_init_data(lc.Weight) for lc in loot_configs], Fraction(0))
-        for loot_config in loot_configs:
-            probability = 0 if total_weight == 0 else eval_init_data(loot_config.Weight) / total_weight
-            config_source = LootSource(loot_config.ConfigurationName, loot_config.ItemAttachments)
+        for loot_config, probability in zip(loot_configs, loot_config_probabilities(loot_configs)):
+            config_source = LootSource(loot_config.ConfigurationName, loot_config.ItemAttachments, self.success_defs, evaluate=False)
             self.configuration_sources += [(config_source, probability)]
 
         assert sum([cs[1] for cs in self.configuration_sources]) == 1
-        self.success_dist: List[Fraction] = [Fraction(0)] * 5
+        self.success_dists: Dict[str, List[Fraction]] = {}
+        self.success_dist: Optional[List[Fraction]] = None
+        self._balance_probs: Optional[Dict[str, Fraction]] = None
+        if evaluate:
+            self.evaluate()
+
+    @property
+    def balance_probs(self) -> Dict[str, Fraction]:
+        """Expected drops of each balance path per opening, from the configurations' when first asked for"""
+        if self._balance_probs is None:
+            if self.success_dist is None:
+                raise ValueError(f"{self.name} hasn't been evaluated, balance_probs needs evaluate() or a cached result first")
+            self._balance_probs = {}
+            for config_source, probability in self.configuration_sources:
+                for key, p in config_source.balance_probs.items():
+                    self._balance_probs[key] = self._balance_probs.get(key, Fraction(0)) + p * probability
+        return self._balance_probs
+
+    @balance_probs.setter
+    def balance_probs(self, balance_probs: Dict[str, Fraction]) -> None:
+        self._balance_probs = balance_probs
+
+    def evaluate(self) -> None:
+        for _ in self.evaluate_steps():
+            pass
+
+    def evaluate_steps(self) -> Iterator[None]:
+        for config_source, _ in self.configuration_sources:
+            yield from config_source.evaluate_steps()
+
+        self._balance_probs = None
+
+        for success_name in self.success_defs:
+            self.success_dists[success_name] = [
+                sum([cs[0].success_dists[success_name][i] * cs[1] for cs in self.configuration_sources], Fraction(0))
+                for i in range(5)
+            ]
+        self.success_dist = next(iter(self.success_dists.values()))
 
-        for i in range(5):
-            self.success_dist[i] = sum([cs[0].success_dist[i] * cs[1] for cs in self.configuration_sources], Fraction(0))
+    def step_count(self) -> int:
+        return sum(config_source.step_count() for config_source, _ in self.configuration_sources)
 
 
 class InteractiveObjectLootListSource(InteractiveObjectSource):
     """For instantiating from InteractiveObjectLootListDefinition paths"""
 
-    def __init__(self, name: str, loot_list_def_paths: List[str]):
+    def __init__(self, name: str, loot_list_def_paths: List[str],
+                 success_defs: Optional[Dict[str, SuccessDef]] = None, evaluate: bool = True):
         loot_configs: List[LootConfigurationData] = []
         for path in loot_list_def_paths:
             loot_list_def = FindObject('InteractiveObjectLootListDefinition', path)
             loot_configs += list(loot_list_def.LootData)
 
-        super().__init__(name, loot_configs)
+        super().__init__(name, loot_configs, success_defs, evaluate)
 
 
 class InteractiveObjectBalanceSource(InteractiveObjectSource):
     """For instantiating from a single path name for InteractiveObjectBalanceDefinition."""
 
-    def __init__(self, name: str, iobd_path: str):
+    def __init__(self, name: str, iobd_path: str,
+                 success_defs: Optional[Dict[str, SuccessDef]] = None, evaluate: bool = True):
         iobd = cast(InteractiveObjectBalanceDefinition, FindObject('InteractiveObjectBalanceDefinition', iobd_path))
         loot_configs: List[LootConfigurationData] = list(iobd.DefaultLoot)
         for loot_list in iobd.DefaultIncludedLootLists:
             loot_configs += list(loot_list.LootData)
 
-        super().__init__(name, loot_configs)
+        super().__init__(name, loot_configs, success_defs, evaluate)
 
 
-def copy_clipboard(inlist: List[List]) -> None:
-    clipboard_string = ''
-    for l in inlist:
-        l = [str(i) for i in l]
-        clipboard_string += '\t'.join(l) + '\n'
+class SourcePlanner:
+    """Evaluates sources together instead of one after another. First every distinct ItemPoolInfo across all of them is
+    resolved and evaluated on the run's PoolGraph, once for each set of success definitions using it, then each source is
+    put together from those cached results. The work follows the number of distinct pools rather than how many sources
+    share them, e.g. the enemy pool lists that all include the same lists. Sources must be created with evaluate=False.
+    Has the same step interface as a source, so it can run under TimeSlicedRunner. A step is a whole top level pool,
+    PoolGraph.add_pool and SuccessTable.pool go through its subtree in one go, so a big one like a raid boss list can
+    still take a whole step's work in one frame."""
 
-    subprocess.run(['powershell', '-command', f"Set-Clipboard -Value '{clipboard_string}'"])
+    def __init__(self, sources: List[Union[LootSource, InteractiveObjectSource]], name: str = 'Drop chances',
+                 on_source_complete: Optional[Callable[[Union[LootSource, InteractiveObjectSource]], None]] = None):
+        self.name = name
+        self.sources = sources
+        self.on_source_complete = on_source_complete
+        self.pool_info_count = 0
+        # (ItemPool, PoolProbability): the ItemPoolInfo and the success definitions of the sources using it
+        self.pool_infos: Dict[Tuple, Tuple[ItemPoolInfo, List[Tuple[SuccessDef, ...]]]] = {}
+        for source in sources:
+            for loot_source in self.loot_sources(source):
+                success_defs = tuple(loot_source.success_defs.values())
+                for pool in loot_source.pool_list:
+                    self.pool_info_count += 1
+                    key = (obj_key(pool.ItemPool), init_data_key(pool.PoolProbability))
+                    _, users = self.pool_infos.setdefault(key, (pool, []))
+                    if success_defs not in users:
+                        users.append(success_defs)
+
+    @staticmethod
+    def loot_sources(source: Union[LootSource, InteractiveObjectSource]) -> List[LootSource]:
+        if isinstance(source, InteractiveObjectSource):
+            return [config_source for config_source, _ in source.configuration_sources]
+        return [source]
+
+    def step_count(self) -> int:
+        return len(self.pool_infos) + len(self.sources)
+
+    def evaluate(self) -> None:
+        for _ in self.evaluate_steps():
+            pass
+
+    def evaluate_steps(self) -> Iterator[None]:
+        """One step per distinct ItemPoolInfo, then one per source. name follows what's being worked on, for progress logs."""
+        planner_name = self.name
+        self.name = 'shared pools'
+        for pool, users in self.pool_infos.values():
+            _, _, pool_id = resolve_pool_info(pool)
+            if pool_id is not None:
+                graph = pool_graph()
+                for success_defs in users:
+                    graph.success_table(success_defs).pool(pool_id)
+            yield
+
+        for source in self.sources:
+            self.name = source.name
+            source.evaluate()  # Only cache lookups and each source's own sums by now
+            if self.on_source_complete is not None:
+                self.on_source_complete(source)
+            yield
+        self.name = planner_name
+
+    def report(self) -> str:
+        return f"Planner: {len(self.sources)} sources, {self.pool_info_count} ItemPoolInfos, " \
+               f"{len(self.pool_infos)} distinct"
+
+
+def default_exporter() -> Exporter:
+    """Console plus clipboard in a format that pastes into a spreadsheet"""
+    return MultiExporter([LogExporter(), ClipboardExporter()])
+
+
+def output_results(sources: List[Union[LootSource, InteractiveObjectSource]]) -> None:
+    """Exports already evaluated sources all at once with the default exporter"""
+    exporter = default_exporter()
+    for source in sources:
+        exporter.write_source(source)
+    exporter.close()
+    Log(_EVAL_CACHE.report())
+
+
+class TimeSlicedRunner:
+    """Evaluates sources a pool at a time from the viewport tick, spending at most budget_ms per frame, so the game keeps
+    running while they compute. Sources must be created with evaluate=False.
+
+    The smallest unit is a source's step, a top level pool with everything under it, so budget_ms is checked between
+    steps and a frame always finishes the step it started. One big pool, e.g. a raid boss list, can overrun the budget
+    the first time it's seen. Pools it shares with others are cached after that, see PoolGraph."""
+
+    TICK_HOOK = 'WillowGame.WillowGameViewportClient.Tick'
+
+    def __init__(self, sources: List[Union[LootSource, InteractiveObjectSource]], budget_ms: float = 5,
+                 on_complete: Callable[[List[Union[LootSource, InteractiveObjectSource]]], None] = output_results,
+                 on_progress: Optional[Callable[[int, int, str], None]] = None, progress_interval_s: float = 2,
+                 on_source_complete: Optional[Callable[[Union[LootSource, InteractiveObjectSource]], None]] = None):
+        self.sources = sources
+        self.budget = budget_ms / 1000
+        self.on_complete = on_complete
+        self.on_source_complete = on_source_complete
+        self.on_progress = on_progress or self.log_progress
+        self.progress_interval = progress_interval_s
+        self.total_steps = sum(source.step_count() for source in sources)
+        self.steps_done = 0
+        self.current = None
+        self.last_progress = 0.0
+        self.steps = self._all_steps()
+
+    def _all_steps(self) -> Iterator[None]:
+        for source in self.sources:
+            self.current = source
+            yield from source.evaluate_steps()
+            if self.on_source_complete is not None:
+                self.on_source_complete(source)
+
+    @staticmethod
+    def log_progress(steps_done: int, total_steps: int, current_name: str) -> None:
+        Log(f"Drop chances: {steps_done}/{total_steps} pools evaluated, working on {current_name}")
+
+    def start(self) -> None:
+        self.last_progress = time.perf_counter()
+        RunHook(self.TICK_HOOK, 'DropChances', self.tick)
+
+    def stop(self) -> None:
+        RemoveHook(self.TICK_HOOK, 'DropChances')
+
+    def tick(self, caller: UObject, function, params) -> bool:
+        start = time.perf_counter()
+        try:
+            while True:  # Always at least one step, so progress is made even on slow frames
+                next(self.steps)
+                self.steps_done += 1
+                if time.perf_counter() - start >= self.budget:
+                    break
+        except StopIteration:
+            self.stop()
+            self.on_complete(self.sources)
+            return True
+        except Exception:
+            self.stop()  # Don't fail again on every tick
+            raise
+
+        if start - self.last_progress >= self.progress_interval:
+            self.last_progress = start
+            self.on_progress(self.steps_done, self.total_steps, self.current.name)
+        return True
+
+
+def run_sources(sources: List[Union[LootSource, InteractiveObjectSource]], exporter: Exporter,
+                tick_budget_ms: Optional[float] = None,
+                on_complete: Optional[Callable[[List[Union[LootSource, InteractiveObjectSource]]], None]] = None) -> None:
+    """Evaluates unevaluated sources together with a SourcePlanner, exporting each as soon as it's done. All at once without
+    a tick budget, otherwise in the background with TimeSlicedRunner."""
+    planner = SourcePlanner(sources, on_source_complete=exporter.write_source)
+
+    def complete(_) -> None:
+        exporter.close()
+        Log(planner.report())
+        Log(_EVAL_CACHE.report())
+        if on_complete is not None:
+            on_complete(sources)
+
+    if tick_budget_ms is None:
+        planner.evaluate()
+        complete(sources)
+    else:
+        TimeSlicedRunner([planner], tick_budget_ms, on_complete=complete).start()
 
 
 if __name__ == '__main__':
     """User inputs"""
-    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
-    # _SUCCESS_DEF: Callable[[InventoryBalanceDefinitionWrapper], bool] = lambda inv_bal: inv_bal.rarity == Rarity.Legendary and inv_bal.item_type == ItemType.ClassMod
-    _SUCCESS_DEF: Callable[[InventoryBalanceDefinitionWrapper], bool] = lambda \
-            inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
-
-
-    with open(_BALANCE_REF_PATH, "r") as file:
-        _BALANCE_REF = json.load(file)
-    _PC = cast(UObject, GetEngine().GamePlayers[0].Actor)
-    _GAME_STAGE = _PC.Pawn.GetGameStage()
-    _BALANCE_MOD_P3 = FindObject('BalanceModifierDefinition', 'GD_Playthrough3Tuning.Balance.BalanceMod_PT3')
-    _UNCOMMON_WEIGHT_MULT = Fraction(_BALANCE_MOD_P3.GetUncommonChestItemPoolWeightMultiplier(_GAME_STAGE)).limit_denominator(1000000)
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'  # Or a compact balances.bin from balance_ref.py
+    # success_def: Callable[[InventoryBalanceDefinitionWrapper], bool] = lambda inv_bal: inv_bal.rarity == Rarity.Legendary and inv_bal.item_type == ItemType.ClassMod
+    # success_def: Callable[[InventoryBalanceDefinitionWrapper], bool] = lambda \
+    #         inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
+    # Same as the lambda above, but pools that can't drop Legendary+ weapons or items don't get walked
+    success_def: Callable[[InventoryBalanceDefinitionWrapper], bool] = mask_success_def(rarity_item_type_mask(
+        [r for r in Rarity if r.category == 'Legendary+'], [t for t in ItemType if t.category != 'Other']))
+    set_numeric_mode(NumericMode.Exact)  # NumericMode.Float is much faster for sources with lots of pools
+    _TICK_BUDGET_MS: Optional[float] = None  # Set to e.g. 5 to compute in the background a few ms per frame instead of freezing
+    _EXPORTER: Exporter = default_exporter()  # Or e.g. a MultiExporter adding a CsvExporter from exporters.py
+
+    set_live_run_context(load_balance_ref(_BALANCE_REF_PATH), success_def)
 
     LoadPackage('Xmas_Dynamic')
     LoadPackage('Helios_UranusArena')
     LoadPackage('Ice_Dynamic')
 
     sources = [
-        ItemPoolListSource('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear']),
-        ItemPoolListSource('Chubby Pool List', ['GD_Itempools.ListDefs.ChubbyEnemyGunsAndGear']),
-        ItemPoolListSource('Loot Midget Pool List', ['GD_Itempools.ListDefs.LootMidgetLoot']),
-        ItemPoolListSource('Raid Boss Pool List', ['GD_Itempools.ListDefs.RaidBossEnemyGunsAndGear']),
-        ItemPoolListSource('Standard Enemy Pool List', ['GD_Itempools.ListDefs.StandardEnemyGunsAndGear']),
-        ItemPoolListSource('Super Badass Enemy Pool List', ['GD_Itempools.ListDefs.SuperBadassEnemyGunsAndGear']),
-        ItemPoolListSource('Ultimate Badass Enemy Pool List', ['GD_Itempools.ListDefs.UltimateBadassEnemyGunsAndGear']),
-
-        # InteractiveObjectLootListSource('Epic Chest Bandit', ['GD_Itempools.ListDefs.EpicChestBanditLoot']),
-        # InteractiveObjectLootListSource('Epic Chest Hyperion', ['GD_Itempools.ListDefs.EpicChestHyperionLoot']),
-        # InteractiveObjectLootListSource('Epic Chest Red', ['GD_Itempools.ListDefs.EpicChestRedLoot']),
-        # InteractiveObjectLootListSource('Standard Pile', ['GD_Itempools.ListDefs.StandardPileLoot']),
-        # InteractiveObjectLootListSource('Storage Locker', ['GD_Itempools.ListDefs.StorageLockerLoot']),
-        # InteractiveObjectLootListSource('Weapon Chest Bandit', ['GD_Itempools.ListDefs.WeaponChestBanditLoot']),
-        # InteractiveObjectLootListSource('Weapon Chest White', ['GD_Itempools.ListDefs.WeaponChestWhiteLoot']),
+        ItemPoolListSource('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear'], evaluate=False),
+        ItemPoolListSource('Chubby Pool List', ['GD_Itempools.ListDefs.ChubbyEnemyGunsAndGear'], evaluate=False),
+        ItemPoolListSource('Loot Midget Pool List', ['GD_Itempools.ListDefs.LootMidgetLoot'], evaluate=False),
+        ItemPoolListSource('Raid Boss Pool List', ['GD_Itempools.ListDefs.RaidBossEnemyGunsAndGear'], evaluate=False),
+        ItemPoolListSource('Standard Enemy Pool List', ['GD_Itempools.ListDefs.StandardEnemyGunsAndGear'], evaluate=False),
+        ItemPoolListSource('Super Badass Enemy Pool List', ['GD_Itempools.ListDefs.SuperBadassEnemyGunsAndGear'], evaluate=False),
+        ItemPoolListSource('Ultimate Badass Enemy Pool List', ['GD_Itempools.ListDefs.UltimateBadassEnemyGunsAndGear'], evaluate=False),
+
+        # InteractiveObjectLootListSource('Epic Chest Bandit', ['GD_Itempools.ListDefs.EpicChestBanditLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Epic Chest Hyperion', ['GD_Itempools.ListDefs.EpicChestHyperionLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Epic Chest Red', ['GD_Itempools.ListDefs.EpicChestRedLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Standard Pile', ['GD_Itempools.ListDefs.StandardPileLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Storage Locker', ['GD_Itempools.ListDefs.StorageLockerLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Weapon Chest Bandit', ['GD_Itempools.ListDefs.WeaponChestBanditLoot'], evaluate=False),
+        # InteractiveObjectLootListSource('Weapon Chest White', ['GD_Itempools.ListDefs.WeaponChestWhiteLoot'], evaluate=False),
         #
         # ItemPoolListSource('Uranus', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 6 + [
-        #     'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100']),
+        #     'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100'], evaluate=False),
         # ItemPoolListSource('Cassius', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 5 + [
-        #     'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100']),
+        #     'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100'], evaluate=False),
         # ItemPoolListSource('Haderax - No Chests', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 7 + [
-        #     'GD_Anemone_ItemPools.ListDefs.RaidBossEnemyGunsAndGear']),
-        # InteractiveObjectLootListSource('Loot Train', ['GD_Allium_Lootables.ListDefs.LootCarLA']),
+        #     'GD_Anemone_ItemPools.ListDefs.RaidBossEnemyGunsAndGear'], evaluate=False),
+        # InteractiveObjectLootListSource('Loot Train', ['GD_Allium_Lootables.ListDefs.LootCarLA'], evaluate=False),
     ]
 
-    result_dict = {}
-    clipboard_string = ''
-    for source in sources:
-        Log(f"{source.name}: {[format(float(p), '.4%') for p in source.success_dist]}")
-        str_list = [source.name] + [format(float(p), '.4%') for p in source.success_dist]
-        clipboard_string += '\t'.join(str_list) + '\n'
-
-
-    subprocess.run(['powershell', '-command', f"Set-Clipboard -Value '{clipboard_string}'"])
+    run_sources(sources, _EXPORTER, _TICK_BUDGET_MS)
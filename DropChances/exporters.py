@@ -0,0 +1,192 @@
+"""Writers for evaluated sources. Each source's rows are written as soon as the source finishes, so big runs never build the
+whole output in memory and partial results survive a crash.
+
+An exporter has write_source, called once per finished source, and close, called after the last one. Files are flushed
+after every source, so they can be watched while a long run is still going.
+"""
+import abc
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Any, List, Optional, TextIO
+
+try:
+    from unrealsdk import Log
+except ImportError:
+    Log = print
+
+HEADER = ['Source', '0', '1', '2', '3', '4+']
+
+
+@dataclass
+class ResultRow:
+    name: str  # Source name, with the success definition appended when the source has several
+    source_name: str
+    success_name: str
+    dist: List[Any]  # Chance of 0..3, 4+ successes. Fraction, float or Interval depending on the numeric mode
+
+    def cells(self) -> List[str]:
+        return [self.name] + [format(float(p), '.4%') for p in self.dist]
+
+
+def source_rows(source) -> List[ResultRow]:
+    """One row per success definition of an evaluated source"""
+    rows = []
+    for success_name, success_dist in source.success_dists.items():
+        name = source.name if len(source.success_dists) == 1 else f"{source.name} - {success_name}"
+        rows.append(ResultRow(name, source.name, success_name, list(success_dist)))
+    return rows
+
+
+class Exporter(abc.ABC):
+    def write_source(self, source) -> None:
+        for row in source_rows(source):
+            self.write_row(row)
+
+    @abc.abstractmethod
+    def write_row(self, row: ResultRow) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FileExporter(Exporter):
+    """Opens the file on creation. Writes the header straight away so even an empty run gives a valid file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file: TextIO = open(path, 'w', newline='', encoding='utf-8')
+        self.write_header()
+
+    def write_header(self) -> None:
+        pass
+
+    def write_source(self, source) -> None:
+        super().write_source(source)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class DelimitedExporter(FileExporter):
+    """CSV by default. Quoting is done by the csv module, so names with commas, quotes or tabs are safe."""
+
+    def __init__(self, path: str, delimiter: str = ','):
+        self.delimiter = delimiter
+        self.writer = None
+        super().__init__(path)
+
+    def write_header(self) -> None:
+        self.writer = csv.writer(self.file, delimiter=self.delimiter, lineterminator='\n')
+        self.writer.writerow(HEADER)
+
+    def write_row(self, row: ResultRow) -> None:
+        self.writer.writerow(row.cells())
+
+
+class CsvExporter(DelimitedExporter):
+    def __init__(self, path: str):
+        super().__init__(path, ',')
+
+
+class TsvExporter(DelimitedExporter):
+    """Pastes straight into a spreadsheet"""
+
+    def __init__(self, path: str):
+        super().__init__(path, '\t')
+
+
+class JsonLinesExporter(FileExporter):
+    """One JSON object per row with unformatted probabilities, for other scripts to read. Interval mode adds the error bounds."""
+
+    def write_row(self, row: ResultRow) -> None:
+        record = {'source': row.source_name, 'success': row.success_name, 'dist': [float(p) for p in row.dist]}
+        if row.dist and hasattr(row.dist[0], 'error'):
+            record['error'] = [p.error for p in row.dist]
+        self.file.write(json.dumps(record) + '\n')
+
+
+class MarkdownExporter(FileExporter):
+    def write_header(self) -> None:
+        self.file.write('| ' + ' | '.join(HEADER) + ' |\n')
+        self.file.write('|' + '---|' * len(HEADER) + '\n')
+
+    def write_row(self, row: ResultRow) -> None:
+        cells = [cell.replace('|', '\\|') for cell in row.cells()]
+        self.file.write('| ' + ' | '.join(cells) + ' |\n')
+
+
+class LogExporter(Exporter):
+    """Console output"""
+
+    def write_row(self, row: ResultRow) -> None:
+        cells = row.cells()
+        Log(f"{cells[0]}: {cells[1:]}")
+
+
+class ClipboardExporter(Exporter):
+    """Tab separated rows, copied in one go on close since the clipboard can't be appended to. The text goes to the clipboard
+    tool on stdin rather than the command line, so nothing needs quoting."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def write_row(self, row: ResultRow) -> None:
+        self.lines.append('\t'.join(row.cells()))
+
+    @staticmethod
+    def clipboard_command() -> Optional[List[str]]:
+        if sys.platform == 'win32':
+            return ['clip']
+        if sys.platform == 'darwin':
+            return ['pbcopy']
+        for command in (['wl-copy'], ['xclip', '-selection', 'clipboard'], ['xsel', '--clipboard', '--input']):
+            if shutil.which(command[0]):
+                return command
+        return None
+
+    def close(self) -> None:
+        command = self.clipboard_command()
+        if command is None:
+            Log("No clipboard tool found, results not copied")
+            return
+        text = '\n'.join(self.lines) + '\n'
+        # clip reads the console code page unless given UTF-16 with a BOM
+        data = text.encode('utf-16') if command == ['clip'] else text.encode('utf-8')
+        subprocess.run(command, input=data)
+
+
+class MultiExporter(Exporter):
+    """Sends every source to several exporters"""
+
+    def __init__(self, exporters: List[Exporter]):
+        self.exporters = exporters
+
+    def write_source(self, source) -> None:
+        for exporter in self.exporters:
+            exporter.write_source(source)
+
+    def write_row(self, row: ResultRow) -> None:
+        for exporter in self.exporters:
+            exporter.write_row(row)
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
+
+
+_EXTENSIONS = {'.csv': CsvExporter, '.tsv': TsvExporter, '.jsonl': JsonLinesExporter, '.md': MarkdownExporter}
+
+
+def exporter_for_path(path: str) -> FileExporter:
+    """Picks the format from the file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _EXTENSIONS:
+        raise ValueError(f"Don't know how to export to {path}, expected one of {sorted(_EXTENSIONS)}")
+    return _EXTENSIONS[extension](path)
@@ -0,0 +1,127 @@
+"""Odds over many kills/openings of one source.
+
+A source's success_dist is the chance of 0, 1, 2, 3 and 4+ successes from one kill. Kills are independent, so the
+distribution over n kills is the per-kill distribution convolved with itself n times, which is done here by squaring, in
+O(log n) convolutions. Everything past max_k successes is lumped into the last entry, so the distributions stay small no matter
+how many kills. Math is done in floats, exact fractions get unwieldy after a few squarings.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+
+def as_floats(dist: List) -> List[float]:
+    return [float(p) for p in dist]
+
+
+def truncate(dist: List[float], max_k: int) -> List[float]:
+    """Lumps everything from max_k up into the last entry. max_k can't be past the last entry, that's already lumped."""
+    if max_k > len(dist) - 1:
+        raise ValueError(f"Distribution only goes up to {len(dist) - 1}+, can't count up to {max_k}")
+    return dist[:max_k] + [sum(dist[max_k:])]
+
+
+def convolve(a: List[float], b: List[float], max_k: int) -> List[float]:
+    """Distribution of the sum of two independent counts, everything from max_k up lumped into the last entry"""
+    result = [0.0] * (max_k + 1)
+    for i, p in enumerate(a):
+        if p == 0:
+            continue
+        for j, q in enumerate(b):
+            result[min(i + j, max_k)] += p * q
+    return result
+
+
+def power(dist: List[float], n: int, max_k: Optional[int] = None) -> List[float]:
+    """Distribution over n independent repeats, by squaring"""
+    max_k = len(dist) - 1 if max_k is None else max_k
+    base = truncate(as_floats(dist), max_k)
+    result = [1.0] + [0.0] * max_k
+    while n > 0:
+        if n & 1:
+            result = convolve(result, base, max_k)
+        n >>= 1
+        if n:
+            base = convolve(base, base, max_k)
+    return result
+
+
+def chance_at_least(dist: List[float], n: int, k: int = 1) -> float:
+    """Chance of k or more successes in n kills"""
+    return max(0.0, 1 - sum(power(dist, n, k)[:k]))
+
+
+def expected_kills(dist: List[float], k: int = 1) -> float:
+    """Expected kills until the k-th success. Solved directly from the chain of success counts, no iterating over kills.
+    Infinite if the source can't give a success."""
+    d = truncate(as_floats(dist), k)
+    if d[0] >= 1:
+        return float('inf')
+    # e[s] = expected further kills with s successes so far
+    e = [0.0] * (k + 1)
+    for s in range(k - 1, -1, -1):
+        e[s] = (1 + sum(d[j] * e[s + j] for j in range(1, k - s))) / (1 - d[0])
+    return e[0]
+
+
+def percentile_kills(dist: List[float], probability: float, k: int = 1, max_kills: int = 10 ** 9) -> Optional[int]:
+    """Fewest kills with at least the given chance of k successes. None if that takes more than max_kills."""
+    if chance_at_least(dist, max_kills, k) < probability:
+        return None
+    hi = 1
+    while chance_at_least(dist, hi, k) < probability:
+        hi *= 2
+    lo = hi // 2 + 1 if hi > 1 else 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if chance_at_least(dist, mid, k) >= probability:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def farming_summary(source: Source, kill_counts: Tuple[int, ...] = (1, 10, 50, 100, 200, 500, 1000),
+                    percentiles: Tuple[float, ...] = (0.5, 0.9, 0.99), k: int = 1) -> Dict[str, Dict[str, List]]:
+    """For each success definition of an evaluated source, chance of k+ successes after each kill count, the kills needed
+    for each percentile, and the expected kills"""
+    summary = {}
+    for success_name, dist in source.success_dists.items():
+        summary[success_name] = {
+            'chances': [[n, chance_at_least(dist, n, k)] for n in kill_counts],
+            'percentiles': [[p, percentile_kills(dist, p, k)] for p in percentiles],
+            'expected': [expected_kills(dist, k)],
+        }
+    return summary
+
+
+def log_farming_summary(source: Source, k: int = 1, **kwargs) -> None:
+    for success_name, stats in farming_summary(source, k=k, **kwargs).items():
+        name = source.name if len(source.success_dists) == 1 else f"{source.name} - {success_name}"
+        drops.Log(f"{name}: expected kills for {k}+ successes {stats['expected'][0]:.1f}")
+        drops.Log("    " + ', '.join(f"{n} kills {p:.2%}" for n, p in stats['chances']))
+        drops.Log("    " + ', '.join(f"{p:.0%} by {'never' if n is None else n}" for p, n in stats['percentiles']))
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _SUCCESSES = 1  # Successes wanted in total over the farming run
+    success_def: drops.SuccessDef = lambda \
+            inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), success_def)
+    drops.LoadPackage('Helios_UranusArena')
+
+    sources = [
+        drops.ItemPoolListSource('Uranus', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 6 + [
+            'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100']),
+        drops.ItemPoolListSource('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear']),
+    ]
+    for source in sources:
+        log_farming_summary(source, _SUCCESSES)
@@ -2,10 +2,58 @@ import inspect
 import json
 import os
 from random import choice
+from typing import Dict, List, Optional, Tuple
 
-from Mods.WD.drops import ItemType, Rarity, path_name, PC
+from Mods.WD.drops import ItemType, Rarity, TimeSlicedRunner, path_name
 from unrealsdk import Log, FindAll, FindObject, LogAllCalls, FStruct, UObject, GetEngine, LoadObject, LoadPackage, FArray
 
+# Actor class spawned for each item type, used both for spawned items and for the static InventoryClass lookup
+_INVENTORY_CLASS_TYPES = {
+    'WillowShield': ItemType.Shield,
+    'WillowClassMod': ItemType.ClassMod,
+    'WillowGrenadeMod': ItemType.Grenade,
+    'WillowUsableCustomizationItem': ItemType.Skin,
+    'WillowArtifact': ItemType.Artifact,
+}
+
+# Definition classes that give the item type whatever actor they spawn as. Skins and heads are both customizations.
+_DEFINITION_CLASS_TYPES = {
+    'UsableCustomizationItemDefinition': ItemType.Skin,
+    'ClassModDefinition': ItemType.ClassMod,
+    'CrossDLCClassModDefinition': ItemType.ClassMod,
+    'ShieldDefinition': ItemType.Shield,
+    'GrenadeModDefinition': ItemType.Grenade,
+    'ArtifactDefinition': ItemType.Artifact,
+}
+
+# Part list collection slots, with the definition's own part list used when the collection doesn't enable the slot
+_WEAPON_PART_SLOTS = {
+    'BodyPartData': 'BodyParts',
+    'GripPartData': 'GripParts',
+    'BarrelPartData': 'BarrelParts',
+    'SightPartData': 'SightParts',
+    'StockPartData': 'StockParts',
+    'ElementalPartData': 'ElementalParts',
+    'Accessory1PartData': 'Accessory1Parts',
+    'Accessory2PartData': 'Accessory2Parts',
+    'MaterialPartData': 'MaterialParts',
+}
+_ITEM_PART_SLOTS = {
+    'AlphaPartData': 'AlphaParts',
+    'BetaPartData': 'BetaParts',
+    'GammaPartData': 'GammaParts',
+    'DeltaPartData': 'DeltaParts',
+    'EpsilonPartData': 'EpsilonParts',
+    'ZetaPartData': 'ZetaParts',
+    'EtaPartData': 'EtaParts',
+    'ThetaPartData': 'ThetaParts',
+    'MaterialPartData': 'MaterialParts',
+}
+
+
+def get_pc() -> UObject:
+    return GetEngine().GamePlayers[0].Actor
+
 
 def get_weapon_data(balance, base_definition):
     part_list = balance.RuntimePartListCollection
@@ -53,28 +101,22 @@ def get_inv_from_balance(balance, game_stages: list):
     else:
         inventory_definition, manufacturer = get_item_data(balance, base_definition)
 
-    item = PC.Spawn(inventory_definition.InventoryClass)
-    game_stage = choice(game_stages)
-    item.Gamestage = game_stage
-    item.InitializeInventory(balance, manufacturer, game_stage, None)
+    item = get_pc().Spawn(inventory_definition.InventoryClass)
+    try:
+        game_stage = choice(game_stages)
+        item.Gamestage = game_stage
+        item.InitializeInventory(balance, manufacturer, game_stage, None)
+    except Exception:
+        item.Destroy()  # Don't leave the spawned actor in the level, e.g. when the balance's package isn't loaded
+        raise
     return item
 
 
 def get_item_type(item: UObject) -> ItemType:
-    type_map = {
-        'WillowShield': ItemType.Shield,
-        'WillowClassMod': ItemType.ClassMod,
-        'WillowGrenadeMod': ItemType.Grenade,
-        'WillowUsableCustomizationItem': ItemType.Skin,
-        'WillowArtifact': ItemType.Artifact,
-    }
     if item.Class.Name == 'WillowWeapon':
         wt = item.DefinitionData.WeaponTypeDefinition.WeaponType
         return ItemType(wt)
-    elif type_map.get(item.Class.Name):
-        return type_map.get(item.Class.Name)
-    else:
-        return ItemType.Other
+    return _INVENTORY_CLASS_TYPES.get(item.Class.Name, ItemType.Other)
 
 
 def get_item_rarity(rarity_level: int):
@@ -95,18 +137,273 @@ def get_item_rarity(rarity_level: int):
     raise ValueError(f"Unknown rarity {rarity_level} provided")
 
 
-def get_balance_to_rarity():
-    '''One time run to build the balances.json file. Keeping here for reference'''
+def balance_chain(balance) -> List[UObject]:
+    """The balance followed by its BaseDefinitions"""
+    chain = []
+    while balance is not None:
+        chain.append(balance)
+        balance = balance.BaseDefinition
+    return chain
+
+
+def get_static_weapon_type(chain: List[UObject]) -> Optional[UObject]:
+    for b in chain:
+        part_list = b.RuntimePartListCollection
+        if part_list and part_list.AssociatedWeaponType:
+            return part_list.AssociatedWeaponType
+        if b.InventoryDefinition and b.InventoryDefinition.Class.Name == 'WeaponTypeDefinition':
+            return b.InventoryDefinition
+    return None
+
+
+def get_static_item_definition(chain: List[UObject]) -> Optional[UObject]:
+    for b in chain:
+        item_definition = b.InventoryDefinition or (b.PartListCollection.AssociatedItem if b.PartListCollection else None)
+        if item_definition:
+            return item_definition
+    return None
+
+
+def get_static_item_type(balance) -> Optional[ItemType]:
+    """Item type from definitions alone, None if it can't be told without spawning"""
+    chain = balance_chain(balance)
+    class_name = balance.Class.Name
+    if "WeaponBalanceDefinition" in class_name:
+        weapon_type = get_static_weapon_type(chain)
+        return ItemType(weapon_type.WeaponType) if weapon_type else None
+    if class_name == "ClassModBalanceDefinition":
+        return ItemType.ClassMod
+    item_definition = get_static_item_definition(chain)
+    if item_definition is None:
+        return None
+    if item_definition.Class.Name in _DEFINITION_CLASS_TYPES:
+        return _DEFINITION_CLASS_TYPES[item_definition.Class.Name]
+    if item_definition.InventoryClass:
+        return _INVENTORY_CLASS_TYPES.get(item_definition.InventoryClass.Name, ItemType.Other)
+    return None
+
+
+def constant_value(init_data) -> Optional[float]:
+    """Value of AttributeInitializationData that doesn't depend on an attribute, None if it does"""
+    if init_data is None or init_data.BaseValueAttribute or init_data.InitializationDefinition:
+        return None
+    return init_data.BaseValueConstant * init_data.BaseValueScaleConstant
+
+
+def parts_rarity(weighted_parts) -> Optional[float]:
+    """BaseRarity any of the parts adds, 0 without parts, None if they don't all add the same"""
+    values = {constant_value(getattr(weighted.Part, 'BaseRarity', None)) for weighted in weighted_parts if weighted.Part}
+    if not values:
+        return 0.0
+    return values.pop() if len(values) == 1 else None
+
+
+def part_list_rarity(collection, definition, slots: Dict[str, str]) -> Optional[float]:
+    """BaseRarity added by the parts the collection picks from, None if it depends on which are picked"""
+    total = 0.0
+    for slot, default_list in slots.items():
+        slot_data = getattr(collection, slot, None) if collection else None
+        if slot_data is not None and slot_data.bEnabled:
+            weighted_parts = slot_data.WeightedParts
+        else:
+            part_list = getattr(definition, default_list, None)
+            weighted_parts = part_list.WeightedParts if part_list else []
+        value = parts_rarity(weighted_parts)
+        if value is None:
+            return None
+        total += value
+    return total
+
+
+def get_static_rarity(balance, item_type: ItemType) -> Optional[Rarity]:
+    """Rarity from definitions alone, None if it can't be told without spawning. The spawned RarityLevel is the
+    definition's BaseRarity plus its parts', so it's known when every part that can be picked for a slot adds the same."""
+    if item_type == ItemType.Artifact:
+        return Rarity.Other  # Same as the spawned classification, artifact rarity isn't tracked
+    chain = balance_chain(balance)
+    collection = next((b.PartListCollection for b in chain if getattr(b, 'PartListCollection', None)), None)
+    slots = _ITEM_PART_SLOTS
+    if item_type.category == 'Weapon':
+        collection = balance.RuntimePartListCollection
+        definitions = [get_static_weapon_type(chain)]
+        slots = _WEAPON_PART_SLOTS
+    elif item_type == ItemType.ClassMod:
+        definitions = next((list(b.ClassModDefinitions) for b in chain if b.ClassModDefinitions), [])  # One is picked
+    elif item_type == ItemType.Skin:
+        definitions = [get_static_item_definition(chain)]
+        collection, slots = None, {}  # Skins and heads have no parts
+    else:
+        definitions = [get_static_item_definition(chain)]
+    if not definitions or None in definitions:
+        return None
+
+    levels = set()
+    for definition in definitions:
+        base = constant_value(definition.BaseRarity)
+        parts = part_list_rarity(collection, definition, slots)
+        if base is None or parts is None:
+            return None
+        levels.add(round(base + parts))
+    if len(levels) != 1:
+        return None
+    try:
+        return get_item_rarity(levels.pop())
+    except ValueError:
+        return None
+
+
+def classify_balance(balance) -> Tuple[Optional[Tuple[Rarity, ItemType]], bool]:
+    """(rarity, item type) or None for non-gear, plus whether it needed spawning. Spawns only when the static rules can't decide."""
+    item_type = get_static_item_type(balance)
+    if item_type == ItemType.Other:
+        return None, False
+    if item_type is not None:
+        rarity = get_static_rarity(balance, item_type)
+        if rarity is not None:
+            return (rarity, item_type), False
+
+    item = get_inv_from_balance(balance, [80])
+    try:
+        item_type = get_item_type(item)
+        if item_type == ItemType.Other:
+            return None, True
+        rarity = get_item_rarity(item.RarityLevel)
+        if item_type == ItemType.Artifact:
+            rarity = Rarity.Other
+        return (rarity, item_type), True
+    finally:
+        item.Destroy()
+
+
+def get_all_balances() -> List[UObject]:
     inv_balances = FindAll('InventoryBalanceDefinition')
     weap_balances = FindAll('WeaponBalanceDefinition')
     cm_balances = FindAll('ClassModBalanceDefinition')
     item_balances = FindAll('ItemBalanceDefinition')
     mission_weap_balances = FindAll('MissionWeaponBalanceDefinition')
 
-    all_balances = inv_balances[1:] + weap_balances[1:] + cm_balances[1:] + item_balances[1:] + mission_weap_balances[1:]
+    return inv_balances[1:] + weap_balances[1:] + cm_balances[1:] + item_balances[1:] + mission_weap_balances[1:]
+
+
+def build_balance_ref() -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+    """Classifies every loaded balance, spawning only for the ones the static rules can't handle.
+    Returns the reference plus the paths that needed the spawn fallback."""
+    balance_rarities = {}
+    fallback_paths = []
+    for inv_bal in get_all_balances():
+        try:
+            result, spawned = classify_balance(inv_bal)
+        except Exception as e:
+            Log(f"Failed to process {inv_bal}: {e}")
+            continue
+        if spawned:
+            fallback_paths.append(path_name(inv_bal))
+        if result:
+            rarity, item_type = result
+            balance_rarities[path_name(inv_bal)] = (rarity.value, item_type.value)
+
+    Log(f"Classified {len(balance_rarities)} balances, {len(fallback_paths)} needed spawning")
+    return balance_rarities, fallback_paths
+
 
+class BalanceRefBuilder:
+    """Incremental, resumable version of build_balance_ref. Only balances missing from the existing reference get classified,
+    non-gear ones included, which are kept in a _non_gear.txt next to it. chunk_size per step, and progress is checkpointed after every chunk so a crash or reload resumes where it left off.
+    Has the evaluate_steps interface of drops sources, so it can be run a chunk per tick with TimeSlicedRunner."""
+
+    def __init__(self, ref_path: str, checkpoint_path: str, chunk_size: int = 25):
+        self.name = 'Balance reference'
+        self.ref_path = ref_path
+        self.checkpoint_path = checkpoint_path
+        self.non_gear_path = os.path.splitext(ref_path)[0] + '_non_gear.txt'
+        self.chunk_size = chunk_size
+
+        self.existing: Dict[str, List[int]] = {}
+        if os.path.exists(ref_path):
+            with open(ref_path, "r") as file:
+                self.existing = json.load(file)
+        self.existing_non_gear: List[str] = []
+        if os.path.exists(self.non_gear_path):
+            with open(self.non_gear_path, "r") as file:
+                self.existing_non_gear = file.read().split()
+
+        # Paths classified as gear, non-gear, needing spawning and failing, carried across resumes. Failed ones aren't done,
+        # they're tried again on resume, e.g. after loading the level whose packages they needed.
+        self.checkpoint = {'results': {}, 'non_gear': [], 'fallback': [], 'failed': {}}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as file:
+                self.checkpoint = json.load(file)
+            Log(f"Resuming balance reference build, {len(self.checkpoint['results'])} already classified, "
+                f"retrying {len(self.checkpoint['failed'])} that failed")
+
+        processed = set(self.checkpoint['results']) | set(self.checkpoint['non_gear']) | set(self.existing_non_gear)
+        self.pending = [balance for balance in get_all_balances()
+                        if path_name(balance) not in self.existing and path_name(balance) not in processed]
+
+    def step_count(self) -> int:
+        return (len(self.pending) + self.chunk_size - 1) // self.chunk_size
+
+    def evaluate_steps(self):
+        for start in range(0, len(self.pending), self.chunk_size):
+            for balance in self.pending[start:start + self.chunk_size]:
+                self.classify(balance)
+            self.save_checkpoint()
+            yield
+
+    def evaluate(self) -> None:
+        for _ in self.evaluate_steps():
+            pass
+
+    def classify(self, balance) -> None:
+        path = path_name(balance)
+        try:
+            result, spawned = classify_balance(balance)
+        except Exception as e:
+            self.checkpoint['failed'][path] = repr(e)
+            return
+        self.checkpoint['failed'].pop(path, None)
+        if spawned:
+            self.checkpoint['fallback'].append(path)
+        if result:
+            rarity, item_type = result
+            self.checkpoint['results'][path] = [rarity.value, item_type.value]
+        else:
+            self.checkpoint['non_gear'].append(path)
+
+    def save_checkpoint(self) -> None:
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, "w") as file:
+            json.dump(self.checkpoint, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def finish(self) -> None:
+        """Merges new results into the reference file and the non-gear list, and removes the checkpoint"""
+        merged = dict(self.existing)
+        merged.update(self.checkpoint['results'])
+        tmp_path = self.ref_path + '.tmp'
+        with open(tmp_path, "w") as file:
+            json.dump(merged, file, indent=4)
+        os.replace(tmp_path, self.ref_path)
+        non_gear = sorted(set(self.existing_non_gear) | set(self.checkpoint['non_gear']))
+        tmp_path = self.non_gear_path + '.tmp'
+        with open(tmp_path, "w") as file:
+            file.write('\n'.join(non_gear))
+        os.replace(tmp_path, self.non_gear_path)
+        with open(os.path.splitext(self.ref_path)[0] + '_fallback.txt', "w") as file:
+            file.write('\n'.join(self.checkpoint['fallback']))
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        Log(f"Added {len(self.checkpoint['results'])} balances to {self.ref_path} and {len(self.checkpoint['non_gear'])} "
+            f"non-gear to {self.non_gear_path}, "
+            f"{len(self.checkpoint['fallback'])} needed spawning, {len(self.checkpoint['failed'])} failed")
+        for path, error in self.checkpoint['failed'].items():
+            Log(f"Failed to process {path}: {error}")
+
+
+def get_balance_to_rarity():
+    '''One time run to build the balances.json file by spawning everything. Keeping here for reference, see build_balance_ref'''
     balance_rarities = {}
-    for inv_bal in all_balances:
+    for inv_bal in get_all_balances():
         try:
             item = get_inv_from_balance(inv_bal, [80])
         except:
@@ -126,4 +423,5 @@ def get_balance_to_rarity():
 
 
 if __name__ == '__main__':
-    get_balance_to_rarity()
+    builder = BalanceRefBuilder('Mods/WD/balances.json', 'Mods/WD/balances_checkpoint.json')
+    TimeSlicedRunner([builder], budget_ms=0, on_complete=lambda _: builder.finish()).start()  # One chunk per tick
@@ -0,0 +1,165 @@
+"""Declarative source manifests, so source libraries can live in version control instead of the __main__ block of drops.py.
+
+A manifest is a JSON file:
+
+    {
+        "packages": ["Xmas_Dynamic"],
+        "sources": [
+            {"type": "ItemPoolListSource", "name": "Badass", "lists": ["GD_Itempools.ListDefs.BadassEnemyGunsAndGear"]},
+            {"type": "CustomItemPoolListSource", "name": "Pawn", "lists": [],
+             "pools": [{"item_pool_path": "...", "BVC": 1.0, "BVA_path": null, "ID_path": null, "BVSC": 1.0}]},
+            {"type": "InteractiveObjectLootListSource", "name": "Red Chest", "loot_lists": ["GD_Itempools.ListDefs.EpicChestRedLoot"]},
+            {"type": "InteractiveObjectBalanceSource", "name": "Chest", "balance": "...", "packages": ["Helios_UranusArena"]}
+        ],
+        "success_defs": {"Legendary+": "rarity.category == Legendary+ and type.category != Other"}
+    }
+
+Packages, top level and per source, are loaded once before anything is evaluated. Lists shared between sources are only looked
+up and flattened once. success_defs is optional, its predicates are in the language of predicates.py and are used when no
+success definitions are passed in. In game run `pyexec manifest.py`. Offline, pass a snapshot to build_sources.
+"""
+import json
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    from Mods.WD import drops
+    from Mods.WD.exporters import MultiExporter, exporter_for_path
+    from Mods.WD.predicates import Predicate, compile_predicates
+    from Mods.WD.result_cache import ResultCache
+except ImportError:
+    import drops
+    from exporters import MultiExporter, exporter_for_path
+    from predicates import Predicate, compile_predicates
+    from result_cache import ResultCache
+
+SOURCE_TYPES = ('ItemPoolListSource', 'CustomItemPoolListSource', 'InteractiveObjectLootListSource',
+                'InteractiveObjectBalanceSource')
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as file:
+        manifest = json.load(file)
+    names = set()
+    for source in manifest.get('sources', []):
+        if source.get('type') not in SOURCE_TYPES:
+            raise ValueError(f"Unknown source type {source.get('type')} in {path}, expected one of {SOURCE_TYPES}")
+        if source.get('name') in names:
+            raise ValueError(f"Duplicate source name {source.get('name')} in {path}")
+        names.add(source.get('name'))
+    compile_predicates(manifest.get('success_defs', {}))  # Fail on a bad predicate now, not after loading packages
+    return manifest
+
+
+def manifest_packages(manifest: Dict[str, Any]) -> List[str]:
+    """Every package the manifest needs, in order, without duplicates"""
+    packages = list(manifest.get('packages', []))
+    for source in manifest.get('sources', []):
+        packages += source.get('packages', [])
+    return list(dict.fromkeys(packages))
+
+
+class LiveSourceBuilder:
+    """Builds sources from live objects, looking up and flattening each list only once. Pool lists come from
+    drops.item_pool_list, cached for the run context."""
+
+    def __init__(self):
+        self.loot_lists: Dict[str, List[drops.LootConfigurationData]] = {}
+
+    def loot_list(self, path: str) -> List[drops.LootConfigurationData]:
+        loot_configs = self.loot_lists.get(path)
+        if loot_configs is None:
+            loot_list_def = drops.FindObject('InteractiveObjectLootListDefinition', path)
+            if not loot_list_def:
+                raise ValueError(f"Could not find InteractiveObjectLootListDefinition {path}, is its package loaded?")
+            loot_configs = self.loot_lists[path] = list(loot_list_def.LootData)
+        return loot_configs
+
+    def build(self, entry: Dict[str, Any], success_defs: Optional[Dict[str, drops.SuccessDef]]) -> Source:
+        name = entry['name']
+        if entry['type'] in ('ItemPoolListSource', 'CustomItemPoolListSource'):
+            pool_list = [drops.ItemPoolInfo.from_paths(drops.ItemPoolInfoPathArgs(**args)) for args in entry.get('pools', [])]
+            for path in entry.get('lists', []):
+                pool_list += drops.item_pool_list(path)
+            return drops.LootSource(name, pool_list, success_defs, evaluate=False)
+
+        if entry['type'] == 'InteractiveObjectLootListSource':
+            loot_configs = []
+            for path in entry['loot_lists']:
+                loot_configs += self.loot_list(path)
+            return drops.InteractiveObjectSource(name, loot_configs, success_defs, evaluate=False)
+
+        iobd = drops.FindObject('InteractiveObjectBalanceDefinition', entry['balance'])
+        if not iobd:
+            raise ValueError(f"Could not find InteractiveObjectBalanceDefinition {entry['balance']}, is its package loaded?")
+        loot_configs = list(iobd.DefaultLoot)
+        for loot_list in iobd.DefaultIncludedLootLists:
+            loot_configs += self.loot_list(drops.path_name(loot_list))
+        return drops.InteractiveObjectSource(name, loot_configs, success_defs, evaluate=False)
+
+
+def build_snapshot_source(snapshot, entry: Dict[str, Any], success_defs: Optional[Dict[str, drops.SuccessDef]]) -> Source:
+    """Offline equivalent of LiveSourceBuilder.build. Custom sources need exporting under their name with export_snapshot."""
+    name = entry['name']
+    if entry['type'] == 'ItemPoolListSource':
+        return snapshot.item_pool_list_source(name, entry['lists'], success_defs)
+    if entry['type'] == 'CustomItemPoolListSource':
+        return snapshot.item_pool_list_source(name, [name], success_defs)
+    if entry['type'] == 'InteractiveObjectLootListSource':
+        return snapshot.interactive_object_loot_list_source(name, entry['loot_lists'], success_defs)
+    return snapshot.interactive_object_balance_source(name, entry['balance'], success_defs)
+
+
+def build_sources(manifest: Dict[str, Any], success_defs: Optional[Dict[str, drops.SuccessDef]] = None,
+                  snapshot=None) -> List[Source]:
+    """Sources for every manifest entry. Live sources are left unevaluated, snapshot ones are evaluated on creation."""
+    if success_defs is None and manifest.get('success_defs'):
+        success_defs = compile_predicates(manifest['success_defs'])
+    if snapshot is not None:
+        return [build_snapshot_source(snapshot, entry, success_defs) for entry in manifest['sources']]
+
+    for package in manifest_packages(manifest):
+        drops.LoadPackage(package)
+    builder = LiveSourceBuilder()
+    return [builder.build(entry, success_defs) for entry in manifest['sources']]
+
+
+def run_manifest(manifest_path: str, results_path: str, tick_budget_ms: Optional[float] = None,
+                 success_defs: Optional[Dict[str, drops.SuccessDef]] = None, cache_path: Optional[str] = None) -> None:
+    """Loads the manifest's packages, evaluates all its sources in one pass and writes the results. Needs a live run context.
+    The results file format follows its extension, see exporters.exporter_for_path. Rows are written as sources finish, so
+    cached sources come first. With a cache_path, only sources whose results aren't cached from an earlier run get evaluated."""
+    sources = build_sources(load_manifest(manifest_path), success_defs)
+    cache = ResultCache(cache_path) if cache_path else None
+    exporter = MultiExporter([exporter_for_path(results_path), drops.default_exporter()])
+
+    pending = []
+    for source in sources:
+        if cache is not None and cache.load(source):
+            exporter.write_source(source)
+        else:
+            pending.append(source)
+
+    def complete(evaluated: List[Source]) -> None:
+        if cache is not None:
+            for source in evaluated:
+                cache.store(source)
+            cache.save()
+            drops.Log(cache.report())
+
+    drops.run_sources(pending, exporter, tick_budget_ms if pending else None, on_complete=complete)
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _MANIFEST_PATH = 'Mods/WD/manifests/example.json'
+    _RESULTS_PATH = 'Mods/WD/results.tsv'  # .csv, .tsv, .jsonl or .md
+    _CACHE_PATH: Optional[str] = 'Mods/WD/result_cache.json'  # None to always evaluate everything
+    _TICK_BUDGET_MS: Optional[float] = None
+    # Used unless the manifest has success_defs
+    success_def: drops.SuccessDef = Predicate('rarity.category == Legendary+ and type.category != Other')
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), success_def)
+    run_manifest(_MANIFEST_PATH, _RESULTS_PATH, _TICK_BUDGET_MS, cache_path=_CACHE_PATH)
@@ -0,0 +1,276 @@
+"""A small language for success definitions, so they can live in manifests and be cached, instead of being lambdas.
+
+    rarity in {Legendary, Pearlescent} and type.category == Weapon
+    rarity.category == Legendary+ and not type in {ClassMod, Shield}
+    path in {'GD_Weap_Pistol.A_Weapons_Unique.Pistol_Maliwan_3_Rubi'} or rarity == Seraph
+
+Fields are rarity, type (or item_type), rarity.category, type.category and path, the balance's path name. Rarities and item
+types are the names of drops.Rarity and drops.ItemType, categories are NonUnique and Legendary+ for rarities and Weapon, Item
+and Other for item types, all case insensitive. Operators are ==, !=, in and not in with a {set}, and path contains 'text',
+one text only. Combine with and, or, not and parentheses. Quote values with anything but letters, digits, _ . and + in them.
+
+Manufacturers aren't in the balance reference, so there's no manufacturer field. Weapon balance paths mostly have it in their
+name, e.g. path contains '_Jakobs_'.
+
+Anything over rarity and type compiles to a mask of rarity/item type pairs (see drops.rarity_item_type_bit), tested with one
+AND per balance, and lets the engine skip pools that can't drop a success. Path tests get the mask of the pairs that could
+still succeed, so pools are skipped as much as the rest of the expression allows.
+"""
+import argparse
+import hashlib
+import re
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+ALL_PAIRS = drops.rarity_item_type_mask()
+
+_TOKEN = re.compile(r"\s*(?:(==|!=|[(){},])|'([^']*)'|\"([^\"]*)\"|([A-Za-z0-9_.+]+))")
+_KEYWORDS = ('and', 'or', 'not', 'in', 'contains')
+
+_RARITY_CATEGORIES = {'nonunique': 'NonUnique', 'legendary+': 'Legendary+'}
+_ITEM_TYPE_CATEGORIES = {'weapon': 'Weapon', 'item': 'Item', 'other': 'Other'}
+_FIELDS = {'rarity': 'rarity', 'type': 'type', 'item_type': 'type', 'rarity.category': 'rarity.category',
+           'type.category': 'type.category', 'item_type.category': 'type.category', 'path': 'path'}
+
+Test = Callable[[int, str], bool]  # Balance's rarity/item type bit and path: success
+
+
+class Node:
+    """Parsed expression. lower and upper are the pairs that always and possibly pass, equal unless paths are involved."""
+
+    def __init__(self, text: str, lower: int, upper: int, test: Test):
+        self.text = text
+        self.lower = lower
+        self.upper = upper
+        self.test = test
+
+
+def _tokenize(source: str) -> List[str]:
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        match = _TOKEN.match(source, pos)
+        if not match:
+            raise ValueError(f"Can't read predicate {source!r} at {source[pos:]!r}")
+        symbol, single, double, word = match.groups()
+        if symbol is not None:
+            tokens.append(symbol)
+        elif word is not None:
+            tokens.append(word.lower() if word.lower() in _KEYWORDS else word)
+        else:
+            tokens.append("'" + (single if single is not None else double))  # Leading ' marks a quoted value
+        pos = match.end()
+    return tokens
+
+
+def _value(token: str) -> str:
+    return token[1:] if token.startswith("'") else token
+
+
+def _pairs_mask(field: str, value: str) -> int:
+    """Pairs where the field has the value"""
+    lowered = value.lower()
+    if field == 'rarity':
+        rarities = [r for r in drops.Rarity if r.name.lower() == lowered]
+        if not rarities:
+            raise ValueError(f"Unknown rarity {value}, expected one of {[r.name for r in drops.Rarity]}")
+        return drops.rarity_item_type_mask(rarities)
+    if field == 'type':
+        item_types = [t for t in drops.ItemType if t.name.lower() == lowered]
+        if not item_types:
+            raise ValueError(f"Unknown item type {value}, expected one of {[t.name for t in drops.ItemType]}")
+        return drops.rarity_item_type_mask(item_types=item_types)
+    if field == 'rarity.category':
+        if lowered not in _RARITY_CATEGORIES:
+            raise ValueError(f"Unknown rarity category {value}, expected one of {list(_RARITY_CATEGORIES.values())}")
+        return drops.rarity_item_type_mask([r for r in drops.Rarity if r.category == _RARITY_CATEGORIES[lowered]])
+    if lowered not in _ITEM_TYPE_CATEGORIES:
+        raise ValueError(f"Unknown item type category {value}, expected one of {list(_ITEM_TYPE_CATEGORIES.values())}")
+    return drops.rarity_item_type_mask(item_types=[t for t in drops.ItemType if t.category == _ITEM_TYPE_CATEGORIES[lowered]])
+
+
+def _canonical_name(field: str, value: str) -> str:
+    if field == 'rarity':
+        return next(r.name for r in drops.Rarity if r.name.lower() == value.lower())
+    if field == 'type':
+        return next(t.name for t in drops.ItemType if t.name.lower() == value.lower())
+    if field == 'rarity.category':
+        return _RARITY_CATEGORIES[value.lower()]
+    return _ITEM_TYPE_CATEGORIES[value.lower()]
+
+
+def _mask_node(text: str, mask: int) -> Node:
+    return Node(text, mask, mask, lambda bit, path: bool(bit & mask))
+
+
+def _path_node(text: str, test: Test) -> Node:
+    return Node(text, 0, ALL_PAIRS, test)
+
+
+def _not(node: Node) -> Node:
+    test = node.test
+    return Node(f"not {node.text}", ALL_PAIRS & ~node.upper, ALL_PAIRS & ~node.lower, lambda bit, path: not test(bit, path))
+
+
+class _Parser:
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, expected: Optional[str] = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            found = 'the end' if token is None else repr(_value(token))
+            raise ValueError(f"Expected {expected or 'more'} in predicate {self.source!r}, found {found}")
+        self.pos += 1
+        return token
+
+    def parse(self) -> Node:
+        node = self.expression()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {_value(self.peek())!r} in predicate {self.source!r}")
+        return node
+
+    def expression(self) -> Node:
+        node = self.conjunction()
+        while self.peek() == 'or':
+            self.take()
+            left, right = node, self.conjunction()
+            node = Node(f"({left.text} or {right.text})", left.lower | right.lower, left.upper | right.upper,
+                        lambda bit, path, a=left.test, b=right.test: a(bit, path) or b(bit, path))
+        return node
+
+    def conjunction(self) -> Node:
+        node = self.negation()
+        while self.peek() == 'and':
+            self.take()
+            left, right = node, self.negation()
+            node = Node(f"({left.text} and {right.text})", left.lower & right.lower, left.upper & right.upper,
+                        lambda bit, path, a=left.test, b=right.test: a(bit, path) and b(bit, path))
+        return node
+
+    def negation(self) -> Node:
+        if self.peek() == 'not':
+            self.take()
+            return _not(self.negation())
+        if self.peek() == '(':
+            self.take()
+            node = self.expression()
+            self.take(')')
+            return node
+        return self.comparison()
+
+    def values(self) -> List[str]:
+        if self.peek() != '{':
+            return [_value(self.take())]
+        self.take('{')
+        values = [_value(self.take())]
+        while self.peek() == ',':
+            self.take()
+            values.append(_value(self.take()))
+        self.take('}')
+        return values
+
+    def comparison(self) -> Node:
+        field_token = self.take()
+        field = _FIELDS.get(field_token.lower())
+        if field is None:
+            raise ValueError(f"Unknown field {_value(field_token)!r} in predicate {self.source!r}, expected one of "
+                             f"{sorted(set(_FIELDS.values()))}")
+        operator = self.take()
+        if operator == 'not':
+            operator = 'not ' + self.take('in')
+        if operator not in ('==', '!=', 'in', 'not in', 'contains'):
+            raise ValueError(f"Unknown operator {_value(operator)!r} in predicate {self.source!r}")
+        if operator == 'contains' and field != 'path':
+            raise ValueError(f"Only path supports contains, in predicate {self.source!r}")
+        values = self.values()
+        if operator in ('==', '!=') and len(values) != 1:
+            raise ValueError(f"{operator} takes one value, use in for sets, in predicate {self.source!r}")
+        if operator == 'contains' and len(values) != 1:
+            raise ValueError(f"contains takes one value, combine several with or, in predicate {self.source!r}")
+
+        if field == 'path':
+            if operator == 'contains':
+                text = values[0]
+                node = _path_node(f"path contains {text!r}", lambda bit, path: text in path)
+            else:
+                paths: FrozenSet[str] = frozenset(values)
+                node = _path_node(f"path in {{{', '.join(repr(p) for p in sorted(paths))}}}", lambda bit, path: path in paths)
+        else:
+            mask = 0
+            for value in values:
+                mask |= _pairs_mask(field, value)
+            names = sorted(set(_canonical_name(field, value) for value in values))
+            node = _mask_node(f"{field} in {{{', '.join(names)}}}", mask)
+        return _not(node) if operator in ('!=', 'not in') else node
+
+
+class Predicate:
+    """Compiled predicate, usable anywhere a success definition is. Equal predicates hash the same, so they share
+    results in the pool graph and the result cache."""
+
+    def __init__(self, source: str):
+        node = _Parser(source).parse()
+        self.source = source
+        self.text = node.text
+        self.rarity_item_type_mask = node.upper  # Pairs that can pass, for pruning in drops.SuccessTable
+        self.exact = node.lower == node.upper  # Whether the mask alone decides it, no path tests needed
+        self._test = node.test
+        # Exact predicates are just their mask, so differently written ones with the same meaning are the same
+        canonical = f"mask {self.rarity_item_type_mask:x}" if self.exact else f"expr {self.text}"
+        self.fingerprint = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def __call__(self, inv_bal: drops.InventoryBalanceDefinitionWrapper) -> bool:
+        bit = drops.rarity_item_type_bit(inv_bal.rarity, inv_bal.item_type)
+        if self.exact:
+            return bool(bit & self.rarity_item_type_mask)
+        return self._test(bit, drops.path_name(inv_bal.inventory_balance_definition))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Predicate) and other.fingerprint == self.fingerprint
+
+    def __hash__(self) -> int:
+        return hash(self.fingerprint)
+
+    def __repr__(self) -> str:
+        return f"Predicate({self.source!r})"
+
+    def pairs(self) -> List[Tuple[drops.Rarity, drops.ItemType]]:
+        """Rarity/item type pairs that can pass"""
+        return [(rarity, item_type) for rarity in drops.Rarity for item_type in drops.ItemType
+                if drops.rarity_item_type_bit(rarity, item_type) & self.rarity_item_type_mask]
+
+
+def compile_predicates(sources: Dict[str, str]) -> Dict[str, Predicate]:
+    """Named predicates, e.g. from a manifest's success_defs, for passing as a source's success_defs"""
+    return {name: Predicate(source) for name, source in sources.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks a predicate and lists what it matches')
+    parser.add_argument('predicate')
+    parser.add_argument('--balance-ref', help='balances.json or balances.bin, to count matching balances')
+    args = parser.parse_args()
+
+    try:
+        predicate = Predicate(args.predicate)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Parsed: {predicate.text}")
+    print(f"{'Exact' if predicate.exact else 'Needs paths, at most'}: "
+          f"{', '.join(f'{r.name} {t.name}' for r, t in predicate.pairs()) or 'nothing'}")
+    if args.balance_ref:
+        balance_ref = drops.load_balance_ref(args.balance_ref)
+        count = sum(1 for path, (rarity, item_type) in balance_ref.items() if predicate(
+            drops.InventoryBalanceDefinitionWrapper(drops.OfflineObject(path), drops.Rarity(rarity), drops.ItemType(item_type))))
+        print(f"{count} of {len(balance_ref)} balances match")
@@ -0,0 +1,151 @@
+"""Results of evaluated sources kept on disk between runs, so unchanged sources aren't recomputed.
+
+A result is keyed on everything that decides it: the source's pools and their init data, game stage, playthrough, uncommon
+weight multiplier, numeric mode, the success definitions and the balance reference. Change any of those and the source is a
+miss and gets evaluated again, anything else is loaded straight from the file along with its per-balance breakdown.
+
+Success definitions are hashed from their compiled code and the values they close over, so editing a lambda invalidates its
+results, but renaming the variable holding it doesn't. Hotfixes changing pool contents aren't part of the key, clear the cache
+after changing those.
+"""
+import hashlib
+import json
+import os
+from fractions import Fraction
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+CACHE_VERSION = 2  # 2: pool Quantity counted
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+
+def _stable_repr(value) -> Any:
+    """repr that doesn't change between runs. Set order depends on string hashing, which is randomized per process."""
+    if isinstance(value, CodeType):
+        return _code_parts(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(v) for v in value)
+    if callable(value) and hasattr(value, '__code__'):
+        return predicate_fingerprint(value)
+    return repr(value)
+
+
+def _code_parts(code: CodeType) -> list:
+    return [code.co_code.hex(), list(code.co_names), [_stable_repr(c) for c in code.co_consts]]
+
+
+def predicate_fingerprint(success_def: drops.SuccessDef) -> str:
+    """Stable hash of a success definition. Objects can provide their own with a fingerprint attribute."""
+    fingerprint = getattr(success_def, 'fingerprint', None)
+    if fingerprint is not None:
+        return fingerprint
+    code = getattr(success_def, '__code__', None)
+    if code is None:
+        raise ValueError(f"Can't fingerprint success definition {success_def!r}, give it a fingerprint attribute")
+    closure = [_stable_repr(cell.cell_contents) for cell in success_def.__closure__ or []]
+    parts = [_code_parts(code), closure, [_stable_repr(d) for d in success_def.__defaults__ or []]]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def balance_ref_fingerprint(balance_ref) -> str:
+    """BalanceRef files carry their own hash. A JSON dict gets hashed here."""
+    fingerprint = getattr(balance_ref, 'fingerprint', None)
+    if fingerprint is not None:
+        return fingerprint
+    return hashlib.sha256(json.dumps(balance_ref, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def pool_list_definition(pool_list: List[drops.ItemPoolInfo]) -> list:
+    return [[drops.obj_key(pool.ItemPool), list(drops.init_data_key(pool.PoolProbability))] for pool in pool_list]
+
+
+def source_definition(source: Source) -> list:
+    """What the source is made of, independent of its name"""
+    if isinstance(source, drops.InteractiveObjectSource):
+        return [[config_source.name, str(probability), pool_list_definition(config_source.pool_list)]
+                for config_source, probability in source.configuration_sources]
+    return pool_list_definition(source.pool_list)
+
+
+def encode_value(value) -> Any:
+    if isinstance(value, drops.Interval):
+        return [value.lo, value.hi]
+    if isinstance(value, float):
+        return value
+    return str(value)
+
+
+def decode_value(value) -> Any:
+    if isinstance(value, list):
+        return drops.Interval(*value)
+    if isinstance(value, float):
+        return value
+    return Fraction(value)
+
+
+class ResultCache:
+    """JSON file of results by key. The run context the keys use is read from drops when they're made, so set it first."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._balance_ref_fingerprint: Optional[Tuple[Any, str]] = None  # (balance ref, its fingerprint)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            if data.get('version') == CACHE_VERSION:  # Older results are dropped rather than migrated
+                self.entries = data['entries']
+
+    def context(self) -> list:
+        """Everything outside the source itself that goes in the key, read each time so a changed run context gets its own
+        keys. Fingerprinting the balance ref is only redone when it's a different one."""
+        if self._balance_ref_fingerprint is None or self._balance_ref_fingerprint[0] is not drops._BALANCE_REF:
+            self._balance_ref_fingerprint = (drops._BALANCE_REF, balance_ref_fingerprint(drops._BALANCE_REF))
+        return [drops._PLAYTHROUGH, drops._GAME_STAGE, str(drops._UNCOMMON_WEIGHT_MULT), drops._NUMERIC_MODE.value,
+                self._balance_ref_fingerprint[1]]
+
+    def key(self, source: Source) -> str:
+        predicates = [[name, predicate_fingerprint(success_def)] for name, success_def in source.success_defs.items()]
+        parts = [CACHE_VERSION, source_definition(source), predicates, self.context()]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def load(self, source: Source) -> bool:
+        """Fills in the source's results if they're cached. False means it still needs evaluating."""
+        entry = self.entries.get(self.key(source))
+        if entry is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        source.success_dists = {name: [decode_value(p) for p in dist] for name, dist in entry['success_dists'].items()}
+        source.success_dist = next(iter(source.success_dists.values()))
+        source.balance_probs = {path: Fraction(p) for path, p in entry['balance_probs'].items()}
+        return True
+
+    def store(self, source: Source) -> None:
+        self.entries[self.key(source)] = {
+            'name': source.name,
+            'success_dists': {name: [encode_value(p) for p in dist] for name, dist in source.success_dists.items()},
+            'balance_probs': {path: str(p) for path, p in source.balance_probs.items()},
+        }
+
+    def save(self) -> None:
+        """Written to a temporary file first, so a crash mid-write can't lose the cache"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries}, file, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+    def clear(self) -> None:
+        self.entries = {}
+        self.save()
+
+    def report(self) -> str:
+        return f"Result cache: {self.hits} sources loaded, {self.misses} evaluated, {len(self.entries)} stored"
@@ -0,0 +1,131 @@
+"""Odds for a whole farming route made of several sources, e.g. a loot train, a few chests and a raid boss.
+
+Sources are independent, so the route's distribution is the convolution of every stop's distribution. Only the evaluated
+success_dists are used, no pools get walked again, so cached results (see result_cache.py) work as well as fresh ones. Stops
+with the same source are merged and raised to their total count by squaring (see farming.py) rather than convolved one
+visit at a time.
+
+A Route has a name and success_dists like a source, so it can be exported like one, or passed to farming.py to get odds over
+repeated runs of the route.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+try:
+    from Mods.WD import drops
+    from Mods.WD.farming import as_floats, convolve, power
+except ImportError:
+    import drops
+    from farming import as_floats, convolve, power
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+
+@dataclass
+class RouteStop:
+    source: Source
+    count: int = 1  # Kills/openings of the source per run
+    chance: float = 1.0  # Chance the source is there at all on a visit, e.g. a chest that doesn't always spawn
+
+
+@dataclass
+class StopContribution:
+    name: str
+    count: int
+    expected: float  # Expected successes per run from this stop. 4+ counts as 4, so it's a lower bound.
+    share: float  # Of the route's expected successes
+    chance_any: float  # Chance of at least one success from this stop alone
+    chance_any_without: float  # Chance of at least one success from the rest of the route
+
+
+class Route:
+    def __init__(self, name: str, stops: List[RouteStop]):
+        self.name = name
+        self.stops = stops
+        success_names = list(stops[0].source.success_dists) if stops else [drops.DEFAULT_SUCCESS_NAME]
+        for stop in stops:
+            missing = [n for n in success_names if n not in stop.source.success_dists]
+            if missing:
+                raise ValueError(f"{stop.source.name} has no results for {missing}, is it evaluated with the same definitions?")
+
+        # Per success name, the distribution of each merged stop over all its visits
+        self.stop_dists: Dict[str, List[List[float]]] = {}
+        self.success_dists: Dict[str, List[float]] = {}
+        for success_name in success_names:
+            dists = [power(self.visit_dist(stop, success_name), stop.count) for stop in self.merged_stops()]
+            self.stop_dists[success_name] = dists
+            route_dist = [1.0] + [0.0] * 4
+            for dist in dists:
+                route_dist = convolve(route_dist, dist, 4)
+            self.success_dists[success_name] = route_dist
+        self.success_dist = next(iter(self.success_dists.values()))
+
+    def merged_stops(self) -> List[RouteStop]:
+        """Stops visiting the same source with the same chance, added up into one"""
+        merged: Dict[tuple, RouteStop] = {}
+        for stop in self.stops:
+            key = (id(stop.source), stop.chance)
+            if key in merged:
+                merged[key] = RouteStop(stop.source, merged[key].count + stop.count, stop.chance)
+            else:
+                merged[key] = RouteStop(stop.source, stop.count, stop.chance)
+        return list(merged.values())
+
+    @staticmethod
+    def visit_dist(stop: RouteStop, success_name: str) -> List[float]:
+        dist = [stop.chance * p for p in as_floats(stop.source.success_dists[success_name])]
+        dist[0] += 1 - stop.chance
+        return dist
+
+    def contributions(self, success_name: Optional[str] = None) -> List[StopContribution]:
+        success_name = success_name or next(iter(self.success_dists))
+        dists = self.stop_dists[success_name]
+        expected = [sum(i * p for i, p in enumerate(dist)) for dist in dists]
+        total_expected = sum(expected)
+        route_none = self.success_dists[success_name][0]
+        contributions = []
+        for stop, dist, stop_expected in zip(self.merged_stops(), dists, expected):
+            if dist[0] > 0:
+                rest_none = route_none / dist[0]
+            else:  # This stop always succeeds, so the rest has to be recomputed without it
+                rest_none = 1.0
+                for other in dists:
+                    if other is not dist:
+                        rest_none *= other[0]
+            contributions.append(StopContribution(
+                name=stop.source.name,
+                count=stop.count,
+                expected=stop_expected,
+                share=0.0 if total_expected == 0 else stop_expected / total_expected,
+                chance_any=1 - dist[0],
+                chance_any_without=1 - rest_none,
+            ))
+        return contributions
+
+    def log_contributions(self, success_name: Optional[str] = None) -> None:
+        drops.Log(f"{self.name}: {[format(p, '.4%') for p in self.success_dists[success_name or next(iter(self.success_dists))]]}")
+        for c in self.contributions(success_name):
+            drops.Log(f"    {c.name} x{c.count}: {c.expected:.4f} expected ({c.share:.1%}), {c.chance_any:.2%} alone, "
+                      f"route without it {c.chance_any_without:.2%}")
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    success_def: drops.SuccessDef = lambda \
+            inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), success_def)
+    drops.LoadPackage('Helios_UranusArena')
+
+    uranus = drops.ItemPoolListSource('Uranus', ['GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss'] * 6 + [
+        'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100'])
+    badass = drops.ItemPoolListSource('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear'])
+    red_chest = drops.InteractiveObjectLootListSource('Epic Chest Red', ['GD_Itempools.ListDefs.EpicChestRedLoot'])
+
+    route = Route('Uranus run', [
+        RouteStop(uranus),
+        RouteStop(badass, count=4),
+        RouteStop(red_chest, count=2, chance=0.5),
+    ])
+    route.log_contributions()
@@ -0,0 +1,244 @@
+"""Monte Carlo simulation of sources, to check the analytic results against and to cover what they don't model.
+
+Rolls are sampled from the same pool data and weights the engine uses, but by walking down the pool tree one roll at a
+time instead of multiplying probabilities out. Pools from an ItemPoolInfo roll Quantity times (see drops.pool_quantity),
+each roll passing PoolProbability on its own, and chest configurations are re-picked when an attachment pool is above the
+game stage, weighted by their own LootConfigurationData.Weight. Both are checked here separately from the engine's handling
+of them, which only shares evaluating init data and game stage requirements.
+
+With NumPy every pool is sampled for a whole batch of trials at once. Without it, as in the game's Python, trials are
+sampled one by one, which is fine for a few hundred thousand.
+"""
+import bisect
+import math
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Source = Union[drops.LootSource, drops.InteractiveObjectSource]
+
+BATCH_SIZE = 100000
+
+
+def wilson_interval(successes: int, trials: int, z: float = 1.96) -> Tuple[float, float]:
+    """Confidence interval for a proportion, 95% by default. Stays sensible near 0 and 1, unlike the normal one."""
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    center = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+@dataclass
+class CompiledPool:
+    cum_weights: List[float]
+    total: float
+    children: List[Tuple[Optional[str], int]]  # (sub-pool path, -1) or (None, balance index), per BalancedItem
+
+
+@dataclass
+class SimulationResult:
+    name: str
+    trials: int
+    counts: Dict[str, List[int]]  # Trials with 0..3, 4+ successes, per success definition
+
+    def dist(self, success_name: str) -> List[float]:
+        return [c / self.trials for c in self.counts[success_name]]
+
+    def intervals(self, success_name: str, z: float = 1.96) -> List[Tuple[float, float]]:
+        return [wilson_interval(c, self.trials, z) for c in self.counts[success_name]]
+
+
+class Simulator:
+    """Samples sources in the current run context. Pools are compiled to cumulative weight tables on first use."""
+
+    def __init__(self, success_defs: Optional[Dict[str, drops.SuccessDef]] = None, seed: Optional[int] = None):
+        self.success_defs = success_defs or {drops.DEFAULT_SUCCESS_NAME: drops._SUCCESS_DEF}
+        self.pools: Dict[str, CompiledPool] = {}
+        self.balance_index: Dict[str, int] = {}
+        self.balance_success: List[List[int]] = []  # Per balance, 1/0 per success definition
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed) if np is not None else None
+        self._success_matrix = None
+
+    def balance(self, inv_bal_def) -> int:
+        path = drops.path_name(inv_bal_def)
+        idx = self.balance_index.get(path)
+        if idx is None:
+            inv_bal = drops.balance_wrapper(inv_bal_def)
+            idx = self.balance_index[path] = len(self.balance_success)
+            self.balance_success.append([int(bool(success_def(inv_bal))) for success_def in self.success_defs.values()])
+            self._success_matrix = None
+        return idx
+
+    def compile(self, item_pool_def: drops.ItemPoolDefinition) -> str:
+        path = drops.path_name(item_pool_def)
+        if path in self.pools:
+            return path
+        weights = [float(w) for w in drops.pool_weights(item_pool_def)]
+        children = []
+        for balanced_item in item_pool_def.BalancedItems:
+            if balanced_item.ItmPoolDefinition:
+                children.append((self.compile(balanced_item.ItmPoolDefinition), -1))
+            elif balanced_item.InvBalanceDefinition:
+                children.append((None, self.balance(balanced_item.InvBalanceDefinition)))
+            else:
+                children.append((None, -1))
+        cum_weights = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cum_weights.append(total)
+        self.pools[path] = CompiledPool(cum_weights, total, children)
+        return path
+
+    def success_matrix(self):
+        """Balance index to successes, with an extra all zero row last so index -1 (nothing dropped) counts nothing"""
+        if self._success_matrix is None:
+            self._success_matrix = np.array(self.balance_success + [[0] * len(self.success_defs)], dtype=np.int32)
+        return self._success_matrix
+
+    # One trial at a time
+
+    def roll_pool(self, path: str) -> int:
+        pool = self.pools[path]
+        while True:
+            if pool.total <= 0:
+                return -1
+            choice = bisect.bisect_right(pool.cum_weights, self.rng.random() * pool.total)
+            sub_pool, balance_idx = pool.children[min(choice, len(pool.children) - 1)]
+            if sub_pool is None:
+                return balance_idx
+            pool = self.pools[sub_pool]
+
+    def roll_pool_list(self, compiled: List[Tuple[str, float, int]], totals: List[int]) -> None:
+        for path, probability, quantity in compiled:
+            for _ in range(quantity):
+                if self.rng.random() < probability:
+                    balance_idx = self.roll_pool(path)
+                    if balance_idx >= 0:
+                        for i, success in enumerate(self.balance_success[balance_idx]):
+                            totals[i] += success
+
+    # Whole batches at once
+
+    def roll_pool_batch(self, path: str, n: int):
+        pool = self.pools[path]
+        result = np.full(n, -1, dtype=np.int64)
+        if pool.total <= 0 or n == 0:
+            return result
+        choices = np.searchsorted(pool.cum_weights, self.np_rng.random(n) * pool.total, side='right')
+        choices = np.minimum(choices, len(pool.children) - 1)
+        for child in np.unique(choices):
+            mask = choices == child
+            sub_pool, balance_idx = pool.children[child]
+            result[mask] = balance_idx if sub_pool is None else self.roll_pool_batch(sub_pool, int(mask.sum()))
+        return result
+
+    def roll_pool_list_batch(self, compiled: List[Tuple[str, float, int]], n: int):
+        totals = np.zeros((n, len(self.success_defs)), dtype=np.int32)
+        for path, probability, quantity in compiled:
+            for _ in range(quantity):
+                passed = np.nonzero(self.np_rng.random(n) < probability)[0]
+                balance_idx = self.roll_pool_batch(path, len(passed))
+                totals[passed] += self.success_matrix()[balance_idx]
+        return totals
+
+    def compile_pool_list(self, pool_list: List[drops.ItemPoolInfo]) -> List[Tuple[str, float, int]]:
+        compiled = []
+        for pool in pool_list:
+            if pool.ItemPool:
+                compiled.append((self.compile(pool.ItemPool), float(drops.eval_prob_item_pool_info(pool)),
+                                 drops.pool_quantity(pool.ItemPool)))
+        return compiled
+
+    def configurations(self, source: Source) -> List[Tuple[List[Tuple[str, float, int]], float]]:
+        """Compiled pool lists with the chance of each being picked, from the raw LootConfigurationData weights rather than
+        the engine's configuration probabilities. Configurations with an attachment pool above the game stage are never
+        kept, if every configuration has one they're all used."""
+        if not isinstance(source, drops.InteractiveObjectSource):
+            return [(self.compile_pool_list(source.pool_list), 1.0)]
+        configs = []
+        for loot_config in source.loot_configs:
+            eligible = all(drops.pool_game_stage_met(pool.ItemPool) for pool in loot_config.ItemAttachments if pool.ItemPool)
+            configs.append((self.compile_pool_list(loot_config.ItemAttachments), float(drops.eval_init_data(loot_config.Weight)),
+                            eligible))
+        if any(eligible for _, _, eligible in configs):
+            configs = [c for c in configs if c[2]]
+        total = sum(probability for _, probability, _ in configs)
+        return [(compiled, probability / total) for compiled, probability, _ in configs if total > 0]
+
+    def simulate(self, source: Source, trials: int) -> SimulationResult:
+        configs = self.configurations(source)
+        counts = [[0] * 5 for _ in self.success_defs]
+        cum_config = []
+        total = 0.0
+        for _, probability in configs:
+            total += probability
+            cum_config.append(total)
+
+        if np is not None:
+            self.success_matrix()
+            done = 0
+            while done < trials:
+                n = min(BATCH_SIZE, trials - done)
+                config_choice = np.searchsorted(cum_config, self.np_rng.random(n) * total, side='right')
+                for config_idx, (compiled, _) in enumerate(configs):
+                    size = int((np.minimum(config_choice, len(configs) - 1) == config_idx).sum())
+                    totals = np.minimum(self.roll_pool_list_batch(compiled, size), 4)
+                    for i in range(len(self.success_defs)):
+                        for k, c in enumerate(np.bincount(totals[:, i], minlength=5)):
+                            counts[i][k] += int(c)
+                done += n
+        else:
+            for _ in range(trials):
+                config_idx = bisect.bisect_right(cum_config, self.rng.random() * total)
+                totals = [0] * len(self.success_defs)
+                self.roll_pool_list(configs[min(config_idx, len(configs) - 1)][0], totals)
+                for i, t in enumerate(totals):
+                    counts[i][min(t, 4)] += 1
+
+        return SimulationResult(source.name, trials, dict(zip(self.success_defs, counts)))
+
+
+def compare(source: Source, result: SimulationResult, z: float = 1.96) -> List[str]:
+    """Lines of analytic against simulated odds, with a * where the analytic value is outside the confidence interval.
+    At 95% about one value in 20 gets flagged by chance alone, a real discrepancy keeps showing up with more trials."""
+    lines = []
+    for success_name, analytic in source.success_dists.items():
+        name = source.name if len(source.success_dists) == 1 else f"{source.name} - {success_name}"
+        lines.append(f"{name}, {result.trials} trials:")
+        for k, (p, sim, (lo, hi)) in enumerate(zip(analytic, result.dist(success_name), result.intervals(success_name, z))):
+            flag = '' if lo - 1e-12 <= float(p) <= hi + 1e-12 else ' *'  # Slack for rounding at exactly 0 or 1
+            lines.append(f"    {k if k < 4 else '4+'}: analytic {float(p):.4%}, simulated {sim:.4%} [{lo:.4%}, {hi:.4%}]{flag}")
+    return lines
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _TRIALS = 100000  # Without NumPy, as in game, this takes a while for big sources
+    success_def: drops.SuccessDef = lambda \
+            inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), success_def)
+
+    sources = [
+        drops.ItemPoolListSource('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear']),
+        drops.InteractiveObjectLootListSource('Epic Chest Red', ['GD_Itempools.ListDefs.EpicChestRedLoot']),
+    ]
+    simulator = Simulator()
+    for source in sources:
+        for line in compare(source, simulator.simulate(source, _TRIALS)):
+            drops.Log(line)
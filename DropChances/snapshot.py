@@ -0,0 +1,370 @@
+"""Snapshot of the loot pool graph, so drop odds can be computed outside the game.
+
+In game, run `pyexec snapshot.py` with the user inputs at the bottom filled in. This walks the pool graph for every listed source
+once and writes the pool structure along with every evaluated AttributeInitializationData value. With _PLAYTHROUGHS and
+_GAME_STAGES set, values are evaluated at every pair of them by moving the loaded character to each in turn, so one export
+covers the whole stage range. Otherwise only the character's own game stage/playthrough is evaluated, and running again
+with another character merges that one into the same file.
+
+Offline, load_snapshot gives back LootSource and InteractiveObjectSource instances built from the file with no unrealsdk needed.
+"""
+import json
+import os
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+SNAPSHOT_FORMAT = 'DropChancesSnapshot'
+SNAPSHOT_VERSION = 1
+
+
+@dataclass
+class OfflineAttribute(drops.OfflineObject):
+    """Stand-in for an AttributeDefinition, only used for MinGameStageRequirement"""
+    value: Optional[float]
+
+    def GetValue(self, _obj) -> Tuple[Optional[float], Any]:
+        if self.value is None:
+            raise ValueError(f"Snapshot has no value for {self.path} at game stage {drops._GAME_STAGE}")
+        return self.value, None
+
+
+@dataclass
+class OfflineItemPool(drops.OfflineObject):
+    BalancedItems: List[drops.BalancedInventoryData]
+    Quantity: Optional[drops.EvaluatedInitializationData]
+    MinGameStageRequirement: Optional[OfflineAttribute]
+    bEligibleForUncommonWeightMultiplier: bool
+
+
+def _empty_snapshot() -> Dict[str, Any]:
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'contexts': [],  # [playthrough, game_stage, uncommon_weight_mult]
+        'init_data': [],  # [BaseValueConstant, BaseValueAttribute, InitializationDefinition, BaseValueScaleConstant]
+        'init_values': [],  # Per context, one value per init_data entry
+        'attributes': [],  # MinGameStageRequirement paths
+        'attribute_values': [],  # Per context, one value per attributes entry
+        'pools': {},  # path: [uncommon_flag, attribute_idx, quantity_init_idx, [[pool_path, balance_path, init_idx, drop_on_death]]]
+        'pool_lists': {},  # path: [[included_list_paths], [[pool_path, init_idx]]]
+        'loot_lists': {},  # path: [[configuration_name, weight_init_idx, [[pool_path, init_idx]]]]
+        'io_balances': {},  # path: [[included_loot_list_paths], [[configuration_name, weight_init_idx, [[pool_path, init_idx]]]]]
+    }
+
+
+def _read_snapshot(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as file:
+        data = json.load(file)
+    if data.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not a drop chances snapshot")
+    if data.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {data.get('version')} not supported, expected {SNAPSHOT_VERSION}")
+    return data
+
+
+class SnapshotExporter:
+    """Walks live loot objects into the snapshot tables. Needs a live run context set in drops."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.init_index: Dict[Tuple, int] = {tuple(init): i for i, init in enumerate(data['init_data'])}
+        self.attribute_index: Dict[str, int] = {path: i for i, path in enumerate(data['attributes'])}
+        self.live_init_data: Dict[int, drops.AttributeInitializationData] = {}
+        self.live_attributes: Dict[int, drops.AttributeDefinition] = {}
+        self.visited: set = set()  # (table, path) walked in this export, so shared nodes are walked once
+
+    def add_init_data(self, init_data: drops.AttributeInitializationData) -> int:
+        key = drops.init_data_key(init_data)
+        idx = self.init_index.get(key)
+        if idx is None:
+            idx = len(self.data['init_data'])
+            self.init_index[key] = idx
+            self.data['init_data'].append(list(key))
+        self.live_init_data[idx] = init_data
+        return idx
+
+    def add_attribute(self, attribute: drops.AttributeDefinition) -> Optional[int]:
+        if not attribute:
+            return None
+        path = drops.path_name(attribute)
+        idx = self.attribute_index.get(path)
+        if idx is None:
+            idx = len(self.data['attributes'])
+            self.attribute_index[path] = idx
+            self.data['attributes'].append(path)
+        self.live_attributes[idx] = attribute
+        return idx
+
+    def add_pool(self, item_pool_def: drops.ItemPoolDefinition) -> Optional[str]:
+        if not item_pool_def:
+            return None
+        path = drops.path_name(item_pool_def)
+        if ('pools', path) in self.visited:
+            return path
+        self.visited.add(('pools', path))
+        balanced_items = [[self.add_pool(balanced_item.ItmPoolDefinition), drops.obj_key(balanced_item.InvBalanceDefinition),
+                           self.add_init_data(balanced_item.Probability), bool(balanced_item.bDropOnDeath)]
+                          for balanced_item in item_pool_def.BalancedItems]
+        self.data['pools'][path] = [bool(item_pool_def.bEligibleForUncommonWeightMultiplier),
+                                    self.add_attribute(item_pool_def.MinGameStageRequirement),
+                                    self.add_init_data(item_pool_def.Quantity), balanced_items]
+        return path
+
+    def add_item_pool_infos(self, item_pool_infos: List[drops.ItemPoolInfo]) -> List[List]:
+        return [[self.add_pool(ipi.ItemPool), self.add_init_data(ipi.PoolProbability)] for ipi in item_pool_infos]
+
+    def add_pool_list(self, ipld: drops.ItemPoolListDefinition, path: Optional[str] = None) -> str:
+        path = path or drops.path_name(ipld)
+        if ('pool_lists', path) not in self.visited:
+            self.visited.add(('pool_lists', path))
+            self.data['pool_lists'][path] = [[self.add_pool_list(included) for included in ipld.ItemPoolIncludedLists],
+                                             self.add_item_pool_infos(ipld.ItemPools)]
+        return path
+
+    def add_loot_configs(self, loot_configs: List[drops.LootConfigurationData]) -> List[List]:
+        return [[lc.ConfigurationName, self.add_init_data(lc.Weight), self.add_item_pool_infos(lc.ItemAttachments)]
+                for lc in loot_configs]
+
+    def add_loot_list(self, loot_list_def: drops.InteractiveObjectLootListDefinition) -> str:
+        path = drops.path_name(loot_list_def)
+        if ('loot_lists', path) not in self.visited:
+            self.visited.add(('loot_lists', path))
+            self.data['loot_lists'][path] = self.add_loot_configs(loot_list_def.LootData)
+        return path
+
+    def add_io_balance(self, iobd: drops.InteractiveObjectBalanceDefinition) -> str:
+        path = drops.path_name(iobd)
+        if ('io_balances', path) not in self.visited:
+            self.visited.add(('io_balances', path))
+            self.data['io_balances'][path] = [[self.add_loot_list(loot_list) for loot_list in iobd.DefaultIncludedLootLists],
+                                              self.add_loot_configs(iobd.DefaultLoot)]
+        return path
+
+    def evaluate_context(self) -> None:
+        """Evaluates every known init data and attribute for the current character, replacing any values for the same context"""
+        context = [drops._PLAYTHROUGH, drops._GAME_STAGE, str(drops._UNCOMMON_WEIGHT_MULT)]
+        init_values = [None] * len(self.data['init_data'])
+        for idx, init_data in self.live_init_data.items():
+            init_values[idx] = str(drops.eval_init_data(init_data))
+        attribute_values = [None] * len(self.data['attributes'])
+        for idx, attribute in self.live_attributes.items():
+            attribute_values[idx] = attribute.GetValue(drops._PC)[0]
+
+        contexts = [c[:2] for c in self.data['contexts']]
+        if context[:2] in contexts:
+            context_idx = contexts.index(context[:2])
+        else:
+            context_idx = len(contexts)
+            self.data['contexts'].append(context)
+            self.data['init_values'].append([])
+            self.data['attribute_values'].append([])
+        self.data['contexts'][context_idx] = context
+        self.data['init_values'][context_idx] = init_values
+        self.data['attribute_values'][context_idx] = attribute_values
+
+        # Older contexts keep their values, padded for anything added by this export
+        for values in self.data['init_values']:
+            values.extend([None] * (len(self.data['init_data']) - len(values)))
+        for values in self.data['attribute_values']:
+            values.extend([None] * (len(self.data['attributes']) - len(values)))
+
+    def evaluate_stage_range(self, playthroughs: List[int], game_stages: List[int]) -> None:
+        """evaluate_context at every playthrough and game stage, moving the loaded character to each in turn. The character
+        is put back where it was however the sweep ends, so the save isn't left at another playthrough or level."""
+        pc = drops._PC
+        original_playthrough, original_game_stage = pc.GetCurrentPlaythrough(), pc.Pawn.GetGameStage()
+        try:
+            for playthrough in playthroughs:
+                for game_stage in game_stages:
+                    move_live_character(playthrough, game_stage)
+                    self.evaluate_context()
+                drops.Log(f"Evaluated playthrough {playthrough} at {len(game_stages)} game stages")
+        finally:
+            # Set directly rather than through move_live_character, which can raise before the context is back
+            pc.SetCurrentPlaythrough(original_playthrough)
+            pc.Pawn.SetGameStage(original_game_stage)
+            drops.set_live_run_context(drops._BALANCE_REF, drops._SUCCESS_DEF)
+
+
+def move_live_character(playthrough: int, game_stage: int) -> None:
+    """Puts the loaded character at another playthrough and game stage, so attributes evaluate as they would there, and
+    sets the live run context to match. Only meant for exporting, the character should be moved back after."""
+    pc = drops._PC
+    pc.SetCurrentPlaythrough(playthrough - 1)
+    pc.Pawn.SetGameStage(game_stage)
+    drops.set_live_run_context(drops._BALANCE_REF, drops._SUCCESS_DEF)
+    if (drops._PLAYTHROUGH, drops._GAME_STAGE) != (playthrough, game_stage):
+        raise ValueError(f"Couldn't move the character to playthrough {playthrough} game stage {game_stage}, "
+                         f"it's at playthrough {drops._PLAYTHROUGH} game stage {drops._GAME_STAGE}")
+
+
+def export_snapshot(out_path: str, ipld_paths: List[str] = (), loot_list_paths: List[str] = (), iobd_paths: List[str] = (),
+                    custom_lists: Dict[str, Tuple[List[drops.ItemPoolInfoPathArgs], List[str]]] = None,
+                    playthroughs: List[int] = (), game_stages: List[int] = ()) -> None:
+    """Exports the graph under the given sources, merging into out_path if it exists. Values are evaluated at every pair
+    of playthroughs and game_stages, or for the current character if they're empty. custom_lists are stored as pool lists
+    under the given name, same args as CustomItemPoolListSource."""
+    data = _read_snapshot(out_path) if os.path.exists(out_path) else _empty_snapshot()
+    exporter = SnapshotExporter(data)
+
+    for path in ipld_paths:
+        exporter.add_pool_list(drops.FindObject('ItemPoolListDefinition', path))
+    for path in loot_list_paths:
+        exporter.add_loot_list(drops.FindObject('InteractiveObjectLootListDefinition', path))
+    for path in iobd_paths:
+        exporter.add_io_balance(drops.FindObject('InteractiveObjectBalanceDefinition', path))
+    for name, (ipi_args_list, included_paths) in (custom_lists or {}).items():
+        included = [drops.FindObject('ItemPoolListDefinition', path) for path in included_paths]
+        custom = drops.ItemPoolListDefinition(included, [drops.ItemPoolInfo.from_paths(ipi_args) for ipi_args in ipi_args_list])
+        exporter.add_pool_list(custom, name)
+
+    if playthroughs and game_stages:
+        exporter.evaluate_stage_range(playthroughs, game_stages)
+    else:
+        exporter.evaluate_context()
+    with open(out_path, 'w') as file:
+        json.dump(data, file, separators=(',', ':'))
+
+
+class Snapshot:
+    """Loot graph for one game stage/playthrough rebuilt from a snapshot file"""
+
+    def __init__(self, data: Dict[str, Any], playthrough: int, game_stage: int):
+        contexts = [tuple(c[:2]) for c in data['contexts']]
+        if (playthrough, game_stage) not in contexts:
+            raise ValueError(f"Snapshot has no values for playthrough {playthrough} game stage {game_stage}. "
+                             f"Available: {sorted(contexts)}")
+        context_idx = contexts.index((playthrough, game_stage))
+        self.data = data
+        self.playthrough = playthrough
+        self.game_stage = game_stage
+        self.uncommon_weight_mult = Fraction(data['contexts'][context_idx][2])
+
+        init_values = data['init_values'][context_idx]
+        self.init_data = [
+            drops.EvaluatedInitializationData(
+                BaseValueConstant=bvc,
+                BaseValueAttribute=drops.OfflineObject(bva) if bva else None,
+                InitializationDefinition=drops.OfflineObject(init_def) if init_def else None,
+                BaseValueScaleConstant=bvsc,
+                value=None if value is None else Fraction(value))
+            for (bvc, bva, init_def, bvsc), value in zip(data['init_data'], init_values)
+        ]
+        self.attributes = [OfflineAttribute(path, value)
+                           for path, value in zip(data['attributes'], data['attribute_values'][context_idx])]
+        self.pools: Dict[str, OfflineItemPool] = {}
+        self.pool_lists: Dict[str, drops.ItemPoolListDefinition] = {}
+
+    def activate(self, balance_ref: Dict[str, List[int]], success_def: Callable[[drops.InventoryBalanceDefinitionWrapper], bool]) -> None:
+        """Points the engine's run context at this snapshot. Needs doing before building any sources."""
+        drops.set_run_context(None, self.game_stage, self.playthrough, self.uncommon_weight_mult, balance_ref, success_def)
+
+    def pool(self, path: Optional[str]) -> Optional[OfflineItemPool]:
+        if path is None:
+            return None
+        pool = self.pools.get(path)
+        if pool is None:
+            uncommon, attribute_idx, quantity_idx, balanced_items = self.data['pools'][path]
+            pool = OfflineItemPool(
+                path=path,
+                BalancedItems=[drops.BalancedInventoryData(
+                    ItmPoolDefinition=self.pool(pool_path),
+                    InvBalanceDefinition=drops.OfflineObject(balance_path) if balance_path else None,
+                    Probability=self.init_data[init_idx],
+                    bDropOnDeath=drop_on_death) for pool_path, balance_path, init_idx, drop_on_death in balanced_items],
+                Quantity=None if quantity_idx is None else self.init_data[quantity_idx],
+                MinGameStageRequirement=None if attribute_idx is None else self.attributes[attribute_idx],
+                bEligibleForUncommonWeightMultiplier=uncommon
+            )
+            self.pools[path] = pool
+        return pool
+
+    def item_pool_infos(self, raw_infos: List[List]) -> List[drops.ItemPoolInfo]:
+        return [drops.ItemPoolInfo(self.pool(pool_path), self.init_data[init_idx]) for pool_path, init_idx in raw_infos]
+
+    def pool_list(self, path: str) -> drops.ItemPoolListDefinition:
+        pool_list = self.pool_lists.get(path)
+        if pool_list is None:
+            included, raw_infos = self.data['pool_lists'][path]
+            pool_list = drops.ItemPoolListDefinition([self.pool_list(p) for p in included], self.item_pool_infos(raw_infos))
+            self.pool_lists[path] = pool_list
+        return pool_list
+
+    def loot_configs(self, raw_configs: List[List]) -> List[drops.LootConfigurationData]:
+        return [drops.LootConfigurationData(name, self.init_data[weight_idx], self.item_pool_infos(raw_infos))
+                for name, weight_idx, raw_infos in raw_configs]
+
+    def item_pool_list_source(self, name: str, ipld_paths: List[str],
+                              success_defs: Optional[Dict[str, drops.SuccessDef]] = None) -> drops.LootSource:
+        """Offline ItemPoolListSource. Custom lists exported with export_snapshot can be referenced by their name."""
+        pool_list: List[drops.ItemPoolInfo] = []
+        for path in ipld_paths:
+            pool_list.extend(drops.LootSource.item_pools_from_item_pool_list_def(self.pool_list(path)))
+        return drops.LootSource(name, pool_list, success_defs)
+
+    def interactive_object_loot_list_source(self, name: str, loot_list_def_paths: List[str],
+                                            success_defs: Optional[Dict[str, drops.SuccessDef]] = None) -> drops.InteractiveObjectSource:
+        loot_configs: List[drops.LootConfigurationData] = []
+        for path in loot_list_def_paths:
+            loot_configs += self.loot_configs(self.data['loot_lists'][path])
+        return drops.InteractiveObjectSource(name, loot_configs, success_defs)
+
+    def interactive_object_balance_source(self, name: str, iobd_path: str,
+                                          success_defs: Optional[Dict[str, drops.SuccessDef]] = None) -> drops.InteractiveObjectSource:
+        included, default_loot = self.data['io_balances'][iobd_path]
+        loot_configs = self.loot_configs(default_loot)
+        for path in included:
+            loot_configs += self.loot_configs(self.data['loot_lists'][path])
+        return drops.InteractiveObjectSource(name, loot_configs, success_defs)
+
+
+def load_snapshot(path: str, playthrough: int, game_stage: int) -> Snapshot:
+    return Snapshot(_read_snapshot(path), playthrough, game_stage)
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'Mods/WD/balances.json'
+    _SNAPSHOT_PATH = 'Mods/WD/snapshot.json'
+    _PLAYTHROUGHS = [1, 2, 3]  # Empty to only export the loaded character's game stage/playthrough
+    _GAME_STAGES = list(range(1, 81))
+
+    drops.set_live_run_context(drops.load_balance_ref(_BALANCE_REF_PATH), lambda inv_bal: False)
+
+    drops.LoadPackage('Xmas_Dynamic')
+    drops.LoadPackage('Helios_UranusArena')
+    drops.LoadPackage('Ice_Dynamic')
+
+    export_snapshot(
+        _SNAPSHOT_PATH,
+        ipld_paths=[
+            'GD_Itempools.ListDefs.BadassEnemyGunsAndGear',
+            'GD_Itempools.ListDefs.ChubbyEnemyGunsAndGear',
+            'GD_Itempools.ListDefs.LootMidgetLoot',
+            'GD_Itempools.ListDefs.RaidBossEnemyGunsAndGear',
+            'GD_Itempools.ListDefs.StandardEnemyGunsAndGear',
+            'GD_Itempools.ListDefs.SuperBadassEnemyGunsAndGear',
+            'GD_Itempools.ListDefs.UltimateBadassEnemyGunsAndGear',
+            'GD_Anemone_ItemPools.ListDefs.Shower_Loot_Boss',
+            'GD_Anemone_ItemPools.ListDefs.Boss_Loot_Legendary100',
+        ],
+        loot_list_paths=[
+            'GD_Itempools.ListDefs.EpicChestBanditLoot',
+            'GD_Itempools.ListDefs.EpicChestHyperionLoot',
+            'GD_Itempools.ListDefs.EpicChestRedLoot',
+            'GD_Allium_Lootables.ListDefs.LootCarLA',
+        ],
+        playthroughs=_PLAYTHROUGHS,
+        game_stages=_GAME_STAGES,
+    )
+    if _PLAYTHROUGHS and _GAME_STAGES:
+        drops.Log(f"Snapshot written to {_SNAPSHOT_PATH} for playthroughs {_PLAYTHROUGHS} game stages "
+                  f"{_GAME_STAGES[0]}-{_GAME_STAGES[-1]}")
+    else:
+        drops.Log(f"Snapshot written to {_SNAPSHOT_PATH} for playthrough {drops._PLAYTHROUGH} game stage {drops._GAME_STAGE}")
@@ -0,0 +1,278 @@
+"""Drop odds for every game stage/playthrough in a snapshot in one traversal of the pool graph.
+
+Instead of evaluating a pool once per character, every init data value and MinGameStageRequirement becomes a vector over the
+snapshot's contexts, and the whole graph is walked once with those vectors. Each source comes back as a context x k matrix.
+Stages available are the ones exported into the snapshot, every game stage of every playthrough when it was exported with
+its default stage range, see snapshot.py.
+
+Success definitions only get to look at the rarity and item_type of the balance here, as per-balance probabilities are never
+enumerated.
+"""
+import json
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    from Mods.WD import drops
+except ImportError:
+    import drops
+
+try:
+    import numpy as np
+except ImportError:  # Not in the game's Python. Lists are plenty fast for a few hundred contexts.
+    np = None
+
+
+class ListVector:
+    """Element-wise float vector for when NumPy isn't available. Only has the operations the sweep needs."""
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def _zip(self, other):
+        if isinstance(other, ListVector):
+            return zip(self.values, other.values)
+        return ((v, other) for v in self.values)
+
+    def __add__(self, other):
+        return ListVector(a + b for a, b in self._zip(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return ListVector(a - b for a, b in self._zip(other))
+
+    def __rsub__(self, other):
+        return ListVector(b - a for a, b in self._zip(other))
+
+    def __mul__(self, other):
+        return ListVector(a * b for a, b in self._zip(other))
+
+    __rmul__ = __mul__
+
+    def __ge__(self, other):
+        return ListVector(float(a >= b) for a, b in self._zip(other))
+
+    def __ne__(self, other):
+        return ListVector(float(a != b) for a, b in self._zip(other))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+def vector(values):
+    return np.array(values, dtype=float) if np is not None else ListVector(values)
+
+
+def safe_div(num, den):
+    """num / den, 0 where den is 0"""
+    if np is not None:
+        return np.divide(num, den, out=np.zeros_like(num), where=den != 0)
+    return ListVector(0.0 if b == 0 else a / b for a, b in num._zip(den))
+
+
+@dataclass
+class SweepResult:
+    name: str
+    contexts: List[Tuple[int, int]]  # (playthrough, game_stage)
+    success_dists: List[List[float]]  # One row of 0..3, 4+ chances per context
+
+
+class StageSweep:
+    """Evaluates sources against every context in a snapshot at once. Pools are memoized, so shared pools are only walked once."""
+
+    def __init__(self, data: Dict[str, Any], balance_ref: Dict[str, List[int]],
+                 success_def: Callable[[drops.InventoryBalanceDefinitionWrapper], bool]):
+        self.data = data
+        self.balance_ref = balance_ref
+        self.success_def = success_def
+
+        order = sorted(range(len(data['contexts'])), key=lambda i: tuple(data['contexts'][i][:2]))
+        self.contexts: List[Tuple[int, int]] = [tuple(data['contexts'][i][:2]) for i in order]
+        self.order = order
+        self.game_stages = vector([c[1] for c in self.contexts])
+        self.uncommon_weight_mult = vector([float(Fraction(data['contexts'][i][2])) for i in order])
+
+        self.init_vectors: Dict[int, Any] = {}
+        self.attribute_vectors: Dict[int, Any] = {}
+        self.pool_weights_memo: Dict[str, Tuple[List[Any], Any]] = {}
+        self.pool_success_memo: Dict[str, Any] = {}
+        self.balance_success_memo: Dict[str, bool] = {}
+
+    def _context_vector(self, table: str, values_table: str, idx: int):
+        values = [self.data[values_table][i][idx] for i in self.order]
+        if any(v is None for v in values):
+            missing = [c for c, v in zip(self.contexts, values) if v is None]
+            raise ValueError(f"Snapshot has no value for {self.data[table][idx]} in contexts {missing}")
+        return vector([float(Fraction(v)) for v in values])
+
+    def init_vector(self, idx: int):
+        vec = self.init_vectors.get(idx)
+        if vec is None:
+            vec = self.init_vectors[idx] = self._context_vector('init_data', 'init_values', idx)
+        return vec
+
+    def stage_met(self, pool_path: str):
+        """1 where the pool's MinGameStageRequirement is met, 0 where not"""
+        attribute_idx = self.data['pools'][pool_path][1]
+        if attribute_idx is None:
+            return 1.0
+        vec = self.attribute_vectors.get(attribute_idx)
+        if vec is None:
+            vec = self.attribute_vectors[attribute_idx] = self._context_vector('attributes', 'attribute_values', attribute_idx)
+        return self.game_stages >= vec
+
+    def pool_weights(self, pool_path: str) -> Tuple[List[Any], Any]:
+        """Weight vector of each balanced item plus the total. Same rules as drops.eval_prob_balanced_item."""
+        memo = self.pool_weights_memo.get(pool_path)
+        if memo is not None:
+            return memo
+        uncommon, _, _, balanced_items = self.data['pools'][pool_path]
+        weights = []
+        for sub_pool, _, init_idx, drop_on_death in balanced_items:
+            if not drop_on_death:
+                weights.append(vector([0.0] * len(self.contexts)))
+                continue
+            weight = self.init_vector(init_idx)
+            if sub_pool:
+                weight = weight * self.stage_met(sub_pool) * (self.pool_weights(sub_pool)[1] != 0)
+            if uncommon and self.data['init_data'][init_idx][2] == 'GD_Balance.Weighting.Weight_2_Uncommon':
+                weight = weight * self.uncommon_weight_mult
+            weights.append(weight)
+        total = sum(weights[1:], weights[0]) if weights else vector([0.0] * len(self.contexts))
+        memo = self.pool_weights_memo[pool_path] = (weights, total)
+        return memo
+
+    def balance_success(self, balance_path: str) -> bool:
+        success = self.balance_success_memo.get(balance_path)
+        if success is None:
+            rarity_item_type = self.balance_ref.get(balance_path) or [0, 11]
+            inv_bal = drops.InventoryBalanceDefinitionWrapper(
+                inventory_balance_definition=drops.OfflineObject(balance_path),
+                rarity=drops.Rarity(rarity_item_type[0]),
+                item_type=drops.ItemType(rarity_item_type[1])
+            )
+            success = self.balance_success_memo[balance_path] = bool(self.success_def(inv_bal))
+        return success
+
+    def pool_success(self, pool_path: str):
+        """Chance of a success given the pool rolls"""
+        success = self.pool_success_memo.get(pool_path)
+        if success is not None:
+            return success
+        weights, total = self.pool_weights(pool_path)
+        success = vector([0.0] * len(self.contexts))
+        for (sub_pool, balance_path, _, _), weight in zip(self.data['pools'][pool_path][3], weights):
+            if sub_pool:
+                success = success + weight * self.pool_success(sub_pool)
+            elif balance_path and self.balance_success(balance_path):
+                success = success + weight
+        success = self.pool_success_memo[pool_path] = safe_div(success, total)
+        return success
+
+    def quantity_vector(self, pool_path: str):
+        """Rolls of the pool per context, same as drops.pool_quantity"""
+        quantity_idx = self.data['pools'][pool_path][2]
+        if quantity_idx is None:
+            return None
+        return vector([max(1.0, float(round(q))) for q in self.init_vector(quantity_idx)])
+
+    def item_pool_infos_success(self, raw_infos: List[List]) -> List[Any]:
+        """Success chance of every roll. Pools rolling Quantity times give one entry per roll, masked to the contexts where
+        the pool makes that many rolls."""
+        probs = []
+        for pool_path, init_idx in raw_infos:
+            if pool_path:
+                prob = self.init_vector(init_idx) * self.stage_met(pool_path) * self.pool_success(pool_path)
+                probs.append(prob)
+                quantity = self.quantity_vector(pool_path)
+                if quantity is not None:
+                    for roll in range(2, int(max(quantity)) + 1):
+                        probs.append(prob * (quantity >= roll))
+        return probs
+
+    def pool_list_infos(self, path: str) -> List[List]:
+        included, raw_infos = self.data['pool_lists'][path]
+        raw_infos = list(raw_infos)
+        for included_path in included:
+            raw_infos.extend(self.pool_list_infos(included_path))
+        return raw_infos
+
+    def _dist_rows(self, dist: List[Any]) -> List[List[float]]:
+        columns = [list(d) if not isinstance(d, float) else [d] * len(self.contexts) for d in dist]
+        return [list(row) for row in zip(*columns)]
+
+    def dist_from_infos(self, raw_infos: List[List]) -> List[Any]:
+        return drops.k_successes_float(self.item_pool_infos_success(raw_infos))
+
+    def item_pool_list(self, name: str, ipld_paths: List[str]) -> SweepResult:
+        raw_infos = []
+        for path in ipld_paths:
+            raw_infos.extend(self.pool_list_infos(path))
+        return SweepResult(name, self.contexts, self._dist_rows(self.dist_from_infos(raw_infos)))
+
+    def config_eligible(self, raw_infos: List[List]):
+        """1 where every attachment pool meets its MinGameStageRequirement. Same rule as drops.loot_config_probabilities."""
+        eligible = 1.0
+        for pool_path, _ in raw_infos:
+            if pool_path:
+                eligible = eligible * self.stage_met(pool_path)
+        return eligible
+
+    def _loot_configs(self, name: str, raw_configs: List[List]) -> SweepResult:
+        weights = [self.init_vector(weight_idx) for _, weight_idx, _ in raw_configs]
+        total = sum(weights[1:], weights[0])
+        eligible_weights = [weight * self.config_eligible(raw_infos) for (_, _, raw_infos), weight in zip(raw_configs, weights)]
+        eligible_total = sum(eligible_weights[1:], eligible_weights[0])
+        any_eligible = eligible_total != 0
+        dist = [0.0] * 5
+        for (_, _, raw_infos), weight, eligible_weight in zip(raw_configs, weights, eligible_weights):
+            config_prob = any_eligible * safe_div(eligible_weight, eligible_total) + (1 - any_eligible) * safe_div(weight, total)
+            dist = [d + config_prob * c for d, c in zip(dist, self.dist_from_infos(raw_infos))]
+        return SweepResult(name, self.contexts, self._dist_rows(dist))
+
+    def interactive_object_loot_list(self, name: str, loot_list_def_paths: List[str]) -> SweepResult:
+        raw_configs = []
+        for path in loot_list_def_paths:
+            raw_configs.extend(self.data['loot_lists'][path])
+        return self._loot_configs(name, raw_configs)
+
+    def interactive_object_balance(self, name: str, iobd_path: str) -> SweepResult:
+        included, default_loot = self.data['io_balances'][iobd_path]
+        raw_configs = list(default_loot)
+        for path in included:
+            raw_configs.extend(self.data['loot_lists'][path])
+        return self._loot_configs(name, raw_configs)
+
+
+def format_sweep(result: SweepResult) -> str:
+    """Tab separated table, one row per context"""
+    lines = ['\t'.join([result.name, 'Game Stage', '0', '1', '2', '3', '4+'])]
+    for (playthrough, game_stage), dist in zip(result.contexts, result.success_dists):
+        lines.append('\t'.join([f"PT{playthrough}", str(game_stage)] + [format(p, '.4%') for p in dist]))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    """User inputs"""
+    _BALANCE_REF_PATH = 'balances.json'
+    _SNAPSHOT_PATH = 'snapshot.json'
+    success_def: Callable[[drops.InventoryBalanceDefinitionWrapper], bool] = lambda \
+            inv_bal: inv_bal.rarity.category == 'Legendary+' and inv_bal.item_type.category != 'Other'
+
+    balance_ref = drops.load_balance_ref(_BALANCE_REF_PATH)
+    with open(_SNAPSHOT_PATH, 'r') as file:
+        snapshot_data = json.load(file)
+
+    sweep = StageSweep(snapshot_data, balance_ref, success_def)
+    results = [
+        sweep.item_pool_list('Badass Enemy Pool List', ['GD_Itempools.ListDefs.BadassEnemyGunsAndGear']),
+        sweep.item_pool_list('Raid Boss Pool List', ['GD_Itempools.ListDefs.RaidBossEnemyGunsAndGear']),
+        # sweep.interactive_object_loot_list('Loot Train', ['GD_Allium_Lootables.ListDefs.LootCarLA']),
+    ]
+    for result in results:
+        print(format_sweep(result))